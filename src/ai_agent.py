@@ -1,9 +1,114 @@
+import io
+import asyncio
+import json
 import os
+import re
+import time
+import hashlib
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from google import genai
+from google.genai import types
 import logging
 
+from .response_cache import ScriptureCache, SemanticCache
+
 logger = logging.getLogger(__name__)
 
+UNAVAILABLE_MESSAGE = "AI Service Unavailable (Missing API Key)."
+ERROR_MESSAGE = "I'm having trouble connecting to my knowledge base right now."
+
+# Static persona and translation policy. Kept at the very front of every discussion
+# request so Gemini's prefix caching can reuse it across turns and users.
+SYSTEM_STATIC = (
+    "You are a knowledgeable, empathetic Bible companion. "
+    "You help the user understand the day's reading and discuss it in depth, "
+    "tailoring your response to the user's background and communication style.\n"
+    "When quoting scripture, use the user's preferred translation and cite the reference. "
+    "If a passage is not in the day's reading, say so before quoting it.\n"
+    "Be concise: ≤150 words unless explicitly asked for depth."
+)
+
+# Explicit caches below this size are rejected by the API, so rely on implicit caching instead
+CACHE_MIN_TOKENS = 1024
+CACHE_TTL_SECONDS = 600
+
+# Output caps. gemini-2.5-flash counts its thinking tokens against max_output_tokens,
+# so every cap gets THINKING_HEADROOM_TOKENS on top to avoid empty/truncated answers.
+DEFAULT_MAX_TOKENS = 256
+DISCUSSION_MAX_TOKENS = 256
+PLAN_MAX_TOKENS = 512
+MEMORY_MAX_TOKENS = 200
+THINKING_HEADROOM_TOKENS = 1024
+# Scripture caps: per quoted verse, or per whole chapter when no verses are given
+TOKENS_PER_VERSE = 40
+TOKENS_PER_CHAPTER = 4096
+BIBLE_TEXT_MAX_TOKENS = 16384
+# Trailing "C", "C:V", "C-C", "C:V-V", "C:V-C:V" or "C-C:V" of one reference part
+_SPAN_RE = re.compile(r"(\d+)(?::(\d+))?(?:\s*[-\u2013]\s*(\d+)(?::(\d+))?)?\s*$")
+
+# Idle seconds before a per-user chat session is dropped and rebuilt from history
+SESSION_TTL_SECONDS = 30 * 60
+# Most history entries a cached session may carry; the SDK re-sends all of them every turn
+SESSION_MAX_HISTORY = 10
+# Token budget for the discussion history kept between turns
+HISTORY_MAX_TOKENS = 1500
+
+# Seconds the semantic-cache lookup may wait for the question's embedding before streaming without it
+SEMANTIC_EMBED_TIMEOUT = 0.5
+
+# Worker threads for Gemini calls; also caps how many requests (and open streams) are in flight
+AI_POOL_SIZE = int(os.environ.get('GEMINI_POOL', '64'))
+
+# First SDK release whose Batch API takes an uploaded JSONL on the Gemini API; before it, batches are Vertex-only
+PLAN_BATCH_MIN_SDK = (1, 24)
+
+# Batch job states after which no further results will arrive
+BATCH_DONE_STATES = ('JOB_STATE_SUCCEEDED', 'JOB_STATE_FAILED', 'JOB_STATE_CANCELLED', 'JOB_STATE_EXPIRED')
+
+# api key -> genai.Client. One client (and its HTTP connection pool) per key for the whole process.
+_clients = {}
+_agent = None
+
+
+def _shared_client(api_key):
+    client = _clients.get(api_key)
+    if client is None:
+        client = _clients[api_key] = genai.Client(api_key=api_key)
+    return client
+
+
+def get_agent(api_key=None):
+    """Returns the process-wide GeminiAgent, creating it on first use."""
+    global _agent
+    if _agent is None:
+        _agent = GeminiAgent(api_key)
+    return _agent
+
+def _sdk_version():
+    return tuple(int(part) for part in re.findall(r"\d+", genai.__version__)[:2])
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token), used instead of a count_tokens round trip."""
+    return len(text or '') // 4
+
+
+def trim_history(history, max_tokens=HISTORY_MAX_TOKENS):
+    """Drops the oldest user/model pairs until `history` fits in `max_tokens`.
+
+    The most recent user/model pair is always kept, even if it alone is over budget.
+    """
+    sizes = [sum(estimate_tokens(part) for part in entry['parts']) for entry in history]
+    total = sum(sizes)
+    start = 0
+    # Keep dropping past a model turn too, so the kept history never opens on an orphaned reply
+    while len(history) - start > 2 and (total > max_tokens or history[start]['role'] != 'user'):
+        total -= sizes[start]
+        start += 1
+    return history[start:]
+
+
 class GeminiAgent:
     def __init__(self, api_key=None):
         self.api_key = api_key or os.environ.get('GEMINI_API_KEY')
@@ -11,55 +116,326 @@ class GeminiAgent:
             logger.warning("No Gemini API key provided. AI features will fail if not mocked.")
             self.client = None
         else:
-            self.client = genai.Client(api_key=self.api_key)
+            self.client = _shared_client(self.api_key)
         self.model_name = 'gemini-2.5-flash'
+        self.embedding_model = 'gemini-embedding-001'
+        self.scripture_cache = ScriptureCache()
+        self.semantic_cache = SemanticCache()
+        # cache name -> monotonic expiry time
+        self._cache_expiry = {}
+        # session key -> (last used monotonic time, chat, history length); session key is the Telegram user id
+        self._chat_sessions = {}
+        # The SDK's aio client runs each call with asyncio.to_thread on the default executor, so the
+        # async methods below run the sync client on a pool of their own instead, away from Drive's
+        self._executor = ThreadPoolExecutor(max_workers=AI_POOL_SIZE, thread_name_prefix='gemini')
 
-    def generate_response(self, prompt, context_history=None):
+    async def agenerate_response(self, prompt, context_history=None, stream=False, config=None, session_key=None,
+                                 max_tokens=DEFAULT_MAX_TOKENS):
         """
-        Generates a response from Gemini.
-        
+        Generates a response from Gemini; the call runs on the Gemini pool.
+
         Args:
             prompt (str): The user's input or system prompt.
             context_history (list): List of dicts [{'role': 'user'/'model', 'parts': ['text']}]
-        
+            stream (bool): If True, return an async iterator of text chunks as they are generated.
+            config (types.GenerateContentConfig): Optional config (system instruction, cached content).
+            session_key: If given, reuse (or create and keep) the chat session stored under this key.
+                         context_history is only used when a new session has to be built
+                         (first turn, expiry, or once the session outgrows SESSION_MAX_HISTORY).
+            max_tokens (int): Cap on the visible response length.
+
         Returns:
-            str: The generated text response.
+            str: The generated text response (or an async iterator of str chunks when streaming).
         """
         if not self.client:
-            return "AI Service Unavailable (Missing API Key)."
+            if stream:
+                return self._aunavailable()
+            return UNAVAILABLE_MESSAGE
+
+        config = self._limit_config(config, max_tokens)
+        if stream:
+            return self._astream_response(prompt, context_history, config, session_key)
 
+        text, _ = await self._agenerate(prompt, context_history, config, session_key)
+        return text
+
+    async def _agenerate(self, prompt, context_history=None, config=None, session_key=None):
+        """Sends one message; returns (text, finish reason), with ERROR_MESSAGE if the call failed."""
         try:
-            # The new SDK handles chat history slightly differently, but often accepts a list of content objects.
-            # We initialize a chat session.
-            chat = self.client.chats.create(
-                model=self.model_name,
-                history=context_history or []
-            )
-            response = chat.send_message(prompt)
-            return response.text
+            chat = self._get_chat(context_history, config, session_key)
+            response = await self._run(chat.send_message, prompt, config=config)
         except Exception as e:
             logger.error(f"Gemini generation error: {e}")
-            return "I'm having trouble connecting to my knowledge base right now."
+            return ERROR_MESSAGE, None
+        candidates = response.candidates or []
+        return response.text, candidates[0].finish_reason if candidates else None
 
-    def generate_reading_plan(self, profile):
-        """Generates a reading plan based on user profile."""
-        prompt = (
+    def _limit_config(self, config, max_tokens):
+        """Returns `config` with the output-token cap (plus thinking headroom) applied."""
+        limits = {'max_output_tokens': max_tokens + THINKING_HEADROOM_TOKENS, 'temperature': 0.7}
+        if config is None:
+            return types.GenerateContentConfig(**limits)
+        return config.model_copy(update=limits)
+
+    async def _run(self, func, *args, **kwargs):
+        """Runs a blocking SDK call on the Gemini pool."""
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, functools.partial(func, *args, **kwargs)
+        )
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    async def _aunavailable(self):
+        yield UNAVAILABLE_MESSAGE
+
+    async def _astream_response(self, prompt, context_history=None, config=None, session_key=None):
+        """Yields text chunks from a streaming Gemini chat call without blocking the event loop.
+
+        The SDK's async stream reads the HTTP response with blocking calls on the loop itself,
+        so the sync stream is pulled instead, one chunk at a time on an executor thread.
+        """
+        try:
+            chat = self._get_chat(context_history, config, session_key)
+            stream = chat.send_message_stream(prompt, config=config)
+            while True:
+                chunk = await self._run(next, stream, None)
+                if chunk is None:
+                    break
+                if chunk.text:
+                    yield chunk.text
+        except Exception as e:
+            logger.error(f"Gemini streaming error: {e}")
+            yield ERROR_MESSAGE
+
+    def _get_chat(self, context_history=None, config=None, session_key=None):
+        """Returns a chat session, reusing the live one cached under `session_key` if any.
+
+        A reused session keeps the config it was created with, so callers pass the current
+        config with every message (e.g. once the reading cache expires).
+        """
+        now = time.monotonic()
+        if session_key is not None:
+            cached = self._chat_sessions.get(session_key)
+            # Each turn adds a user and a model entry; once the session outgrows the window,
+            # rebuild it from the caller's (already trimmed) history instead of re-sending everything.
+            if cached and now - cached[0] < SESSION_TTL_SECONDS and cached[2] + 2 <= SESSION_MAX_HISTORY:
+                self._chat_sessions[session_key] = (now, cached[1], cached[2] + 2)
+                return cached[1]
+
+        # The new SDK handles chat history slightly differently, but often accepts a list of content objects.
+        # We initialize a chat session.
+        chat = self.client.chats.create(
+            model=self.model_name,
+            config=config,
+            history=context_history or []
+        )
+        if session_key is not None:
+            self._chat_sessions[session_key] = (now, chat, len(context_history or []) + 2)
+        return chat
+
+    def reset_session(self, session_key):
+        """Drops the cached chat session for `session_key` (e.g. when a new reading starts)."""
+        self._chat_sessions.pop(session_key, None)
+
+    def evict_stale_sessions(self):
+        """Drops chat sessions idle for longer than SESSION_TTL_SECONDS. Returns how many were dropped."""
+        cutoff = time.monotonic() - SESSION_TTL_SECONDS
+        stale = [key for key, (last_used, _, _) in self._chat_sessions.items() if last_used < cutoff]
+        for key in stale:
+            del self._chat_sessions[key]
+        self._prune_cache_expiry()
+        return len(stale)
+
+    def _reading_plan_prompt(self, profile):
+        return (
             f"Generate a customized daily Bible reading plan for a user with the following preferences:\n"
             f"{profile}\n\n"
             "Create a plan for the first 7 days. "
             "Format the output as a Markdown list with 'Day X: Book Chapter:Verse'."
         )
-        return self.generate_response(prompt)
 
-    def get_bible_text(self, reference, translation="ESV"):
-        """Fetches/Quotes Bible text."""
-        prompt = f"Please provide the full text of {reference} in the {translation} translation."
-        return self.generate_response(prompt)
+    async def agenerate_reading_plan(self, profile):
+        """Generates a reading plan based on user profile."""
+        return await self.agenerate_response(self._reading_plan_prompt(profile), max_tokens=PLAN_MAX_TOKENS)
+
+    def _plan_slice_prompt(self, profile, start_day, days=7):
+        return (
+            f"Context/Preferences: {profile}\n"
+            "Format the output as a Markdown list with 'Day X: Book Chapter:Verse'.\n"
+            f"Generate a daily Bible reading plan for Day {start_day} to Day {start_day + days - 1}."
+        )
+
+    @property
+    def supports_plan_batches(self):
+        """Whether plan slices can go through the Batch API with this client and SDK.
+
+        The slices are uploaded with the Files API, which only the Gemini API (not Vertex AI) offers.
+        """
+        return bool(self.client) and not self.client.vertexai and _sdk_version() >= PLAN_BATCH_MIN_SDK
+
+    async def asubmit_plan_batch(self, profile, start_days, days=7):
+        """
+        Submits plan slices to the Gemini Batch API (half price; results arrive asynchronously).
+
+        Args:
+            profile (dict): The user's preferences.
+            start_days (list): First day of each slice, e.g. [8, 15, 22].
+            days (int): Days per slice.
 
-    def discuss_reading(self, user_input, history, reading_context, profile=None):
-        """Engages in deep-dive discussion with personalization."""
-        
-        # Build persona context from profile
+        Returns:
+            str: The batch job name, or None if the job could not be submitted.
+        """
+        if not self.supports_plan_batches:
+            return None
+
+        src = None
+        try:
+            src = await self._run(
+                self.client.files.upload,
+                file=self._plan_batch_file(profile, start_days, days),
+                config=types.UploadFileConfig(display_name='plan-batch', mime_type='application/jsonl')
+            )
+            job = await self._run(self.client.batches.create, model=self.model_name, src=src.name)
+            return job.name
+        except Exception as e:
+            logger.error(f"Gemini batch submission error: {e}")
+            if src is not None:
+                await self._delete_file(src.name)
+            return None
+
+    async def _delete_file(self, name):
+        """Removes an uploaded file nothing will read, instead of leaving it until it expires."""
+        try:
+            await self._run(self.client.files.delete, name=name)
+        except Exception as e:
+            logger.error(f"Gemini file deletion error for {name}: {e}")
+
+    def _plan_batch_file(self, profile, start_days, days):
+        """Builds the batch input JSONL, one request per plan slice keyed by its start day."""
+        lines = [
+            json.dumps({
+                'key': f"day-{start_day}",
+                'request': {
+                    'contents': [{'role': 'user', 'parts': [{'text': self._plan_slice_prompt(profile, start_day, days)}]}],
+                    'generationConfig': {'maxOutputTokens': PLAN_MAX_TOKENS + THINKING_HEADROOM_TOKENS}
+                }
+            })
+            for start_day in start_days
+        ]
+        return io.BytesIO("\n".join(lines).encode('utf-8'))
+
+    async def apoll_plan_batch(self, job_name):
+        """
+        Checks a plan batch job.
+
+        Returns:
+            dict: {start_day: plan slice text} once the job succeeded,
+                  {} if it ended without usable results, or None while it is still running.
+        """
+        if not self.client:
+            return {}
+
+        try:
+            job = await self._run(self.client.batches.get, name=job_name)
+            if not self._batch_succeeded(job):
+                return None if job.state.name not in BATCH_DONE_STATES else {}
+            content = await self._run(self.client.files.download, file=job.dest.file_name)
+        except Exception as e:
+            logger.error(f"Gemini batch polling error: {e}")
+            return {}
+        return self._parse_batch_results(content)
+
+    def _batch_succeeded(self, job):
+        state = job.state.name
+        if state in BATCH_DONE_STATES and state != 'JOB_STATE_SUCCEEDED':
+            logger.warning(f"Plan batch {job.name} ended in state {state}")
+        return state == 'JOB_STATE_SUCCEEDED'
+
+    def _parse_batch_results(self, content):
+        """Parses batch output JSONL into {start_day: plan slice text}."""
+        results = {}
+        for line in content.decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            try:
+                parts = item['response']['candidates'][0]['content']['parts']
+            except (KeyError, IndexError):
+                continue
+            results[int(item['key'].split('-')[1])] = "".join(part.get('text', '') for part in parts)
+        return results
+
+    def _bible_text_max_tokens(self, reference):
+        """Estimates an output cap for quoting `reference` from its verse/chapter span, erring high."""
+        # "John 3:16-18" -> 3 verses; "Genesis 1-2" -> 2 chapters; "Psalm 23" -> 1 chapter;
+        # "Genesis 1:1-2:3" -> 1 chapter + 3 verses; "Genesis 1; Matthew 1" -> 2 chapters;
+        # "John 3:16, 18" -> 2 verses
+        estimate = 0
+        for passage in reference.split(';'):
+            in_verses = False
+            for part in passage.split(','):
+                span = _SPAN_RE.search(part)
+                if not span:
+                    # e.g. a one-chapter book named without numbers
+                    estimate += TOKENS_PER_CHAPTER
+                    continue
+                start, start_verse, end, end_verse = span.groups()
+                start = int(start)
+                end = int(end) if end else start
+                if end_verse and end > start:
+                    # Crosses into chapter `end`: count the chapters it spans, plus the verses of the last
+                    estimate += (end - start) * TOKENS_PER_CHAPTER + int(end_verse) * TOKENS_PER_VERSE
+                elif end_verse:
+                    estimate += max(int(end_verse) - int(start_verse or 1) + 1, 1) * TOKENS_PER_VERSE
+                elif start_verse:
+                    estimate += max(end - int(start_verse) + 1, 1) * TOKENS_PER_VERSE
+                elif in_verses:
+                    # A bare number after "3:16," continues the verse list
+                    estimate += max(end - start + 1, 1) * TOKENS_PER_VERSE
+                else:
+                    estimate += max(end - start + 1, 1) * TOKENS_PER_CHAPTER
+                in_verses = in_verses or bool(start_verse or end_verse)
+        return max(DEFAULT_MAX_TOKENS, min(estimate, BIBLE_TEXT_MAX_TOKENS))
+
+    async def aget_bible_text(self, reference, translation="ESV"):
+        """Fetches/Quotes Bible text (served from the scripture cache when possible)."""
+        text = self.scripture_cache.get(reference, translation)
+        if text is None:
+            if not self.client:
+                return UNAVAILABLE_MESSAGE
+            prompt = f"Please provide the full text of {reference} in the {translation} translation."
+            config = self._limit_config(None, self._bible_text_max_tokens(reference))
+            text, finish_reason = await self._agenerate(prompt, config=config)
+            # A quote cut off at the output cap is still shown, but must not be served as the full passage
+            if finish_reason == types.FinishReason.MAX_TOKENS:
+                logger.warning(f"Text of {reference} hit the output cap; not caching it")
+            else:
+                self._remember_bible_text(reference, translation, text)
+        return text
+
+    def _remember_bible_text(self, reference, translation, text):
+        if text and text not in (UNAVAILABLE_MESSAGE, ERROR_MESSAGE):
+            self.scripture_cache.set(reference, translation, text)
+
+    async def aembed(self, text):
+        """Returns the embedding vector for `text`, or None if embedding failed."""
+        if not self.client:
+            return None
+        try:
+            result = await self._run(
+                self.client.models.embed_content,
+                model=self.embedding_model,
+                contents=text,
+                config=types.EmbedContentConfig(output_dimensionality=256)
+            )
+            return result.embeddings[0].values
+        except Exception as e:
+            logger.error(f"Gemini embedding error: {e}")
+            return None
+
+    def _build_reading_context(self, reading_context, profile=None):
+        """Builds the per-reading block (profile + scripture) that stays fixed through a discussion."""
         persona_context = ""
         if profile:
             persona_context = (
@@ -68,11 +444,114 @@ class GeminiAgent:
                 f"- Communication Style: {profile.get('style', 'Empathetic')}\n"
                 f"- Translation: {profile.get('translation', 'ESV')}\n"
             )
+            if profile.get('rolling_memory'):
+                persona_context += f"What you remember from earlier conversations:\n{profile['rolling_memory']}\n"
+
+        return f"{persona_context}\nToday's reading:\n{reading_context}\n"
+
+    async def asummarize_history(self, turns, previous_memory=None):
+        """Folds discussion turns (and any earlier memory) into a short note about the user.
+
+        Returns None if summarization failed, so callers keep the previous memory.
+        """
+        prompt = "Summarize these turns in ≤100 words as facts about the user and current spiritual themes:\n"
+        if previous_memory:
+            prompt += f"Earlier notes: {previous_memory}\n"
+        prompt += json.dumps(turns, ensure_ascii=False)
+        summary = await self.agenerate_response(prompt, max_tokens=MEMORY_MAX_TOKENS)
+        if summary in (UNAVAILABLE_MESSAGE, ERROR_MESSAGE):
+            return None
+        return summary.strip()
 
-        full_prompt = (
-            f"Context: User is reading {reading_context}.\n"
-            f"{persona_context}\n"
-            f"User says: {user_input}\n"
-            "Respond as a knowledgeable, empathetic Bible companion, tailoring your response to the user's background and style."
+    async def acreate_reading_cache(self, reading_context, profile=None):
+        """
+        Creates an explicit Gemini cache holding the system persona and today's reading.
+
+        Returns:
+            str: The cache name, or None if the reading is too short to cache or caching failed.
+        """
+        cache_config = self._reading_cache_config(reading_context, profile)
+        if not self.client or cache_config is None:
+            return None
+
+        try:
+            cache = await self._run(self.client.caches.create, model=self.model_name, config=cache_config)
+        except Exception as e:
+            logger.error(f"Gemini cache creation error: {e}")
+            return None
+
+        self._prune_cache_expiry()
+        self._cache_expiry[cache.name] = time.monotonic() + CACHE_TTL_SECONDS
+        return cache.name
+
+    def _prune_cache_expiry(self):
+        """Forgets expired caches, including those of users who never came back to look them up."""
+        now = time.monotonic()
+        for name in [name for name, expiry in self._cache_expiry.items() if expiry <= now]:
+            del self._cache_expiry[name]
+
+    def _reading_cache_config(self, reading_context, profile=None):
+        """Returns the cache config for a reading, or None if it is too short to cache."""
+        reading_block = self._build_reading_context(reading_context, profile)
+        if len(reading_block) // 4 < CACHE_MIN_TOKENS:
+            return None
+        return types.CreateCachedContentConfig(
+            system_instruction=SYSTEM_STATIC,
+            contents=[reading_block],
+            ttl=f"{CACHE_TTL_SECONDS}s"
         )
-        return self.generate_response(full_prompt, context_history=history)
+
+    def _discussion_config(self, reading_context, profile=None, cache_name=None):
+        """Puts the static persona and reading first so only the user's message varies per turn."""
+        expiry = self._cache_expiry.get(cache_name)
+        if expiry and expiry > time.monotonic():
+            return types.GenerateContentConfig(cached_content=cache_name)
+
+        self._cache_expiry.pop(cache_name, None)
+        return types.GenerateContentConfig(
+            system_instruction=f"{SYSTEM_STATIC}\n\n{self._build_reading_context(reading_context, profile)}"
+        )
+
+    def adiscuss_reading_stream(self, user_input, history, reading_context, profile=None, cache_name=None, session_key=None):
+        """Engages in deep-dive discussion with personalization; returns an async iterator of text chunks."""
+        config = self._discussion_config(reading_context, profile, cache_name)
+        return self._asemantic_stream(user_input, history, reading_context, config, session_key)
+
+    async def _asemantic_stream(self, user_input, history, reading_context, config, session_key):
+        """Serves a near-duplicate question from the semantic cache, otherwise streams and remembers the answer."""
+        reading_key = hashlib.sha256(str(reading_context).encode('utf-8')).hexdigest()
+        # Follow-ups ("why?", "explain more") depend on the reply they follow
+        previous = history[-1] if history and history[-1]['role'] == 'model' else None
+        context_key = previous and hashlib.sha256(
+            json.dumps(previous['parts'], ensure_ascii=False).encode('utf-8')
+        ).hexdigest()
+        vector = await self._aembed_question(user_input) if session_key is not None else None
+        if vector is not None:
+            cached = self.semantic_cache.lookup(session_key, reading_key, vector, context_key)
+            if cached is not None:
+                # The live chat session never saw this turn; rebuild it from the caller's history
+                # (which records the served answer) on the next message
+                self.reset_session(session_key)
+                yield cached
+                return
+
+        chunks = []
+        stream = await self.agenerate_response(
+            f"USER: {user_input}", context_history=history, stream=True, config=config, session_key=session_key,
+            max_tokens=DISCUSSION_MAX_TOKENS
+        )
+        async for chunk in stream:
+            chunks.append(chunk)
+            yield chunk
+
+        answer = "".join(chunks)
+        if vector is not None and not answer.endswith((UNAVAILABLE_MESSAGE, ERROR_MESSAGE)):
+            self.semantic_cache.store(session_key, reading_key, vector, answer, context_key)
+
+    async def _aembed_question(self, user_input):
+        """Embeds `user_input` for the semantic cache, giving up (None) rather than delaying the reply."""
+        try:
+            return await asyncio.wait_for(self.aembed(user_input), SEMANTIC_EMBED_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("Question embedding timed out; skipping the semantic cache")
+            return None
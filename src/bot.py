@@ -1,17 +1,25 @@
 import os
 import logging
 import asyncio
-import http.server
-import socketserver
-from telegram import Update
+import re
+import time
+import copy
+import functools
+import warnings
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, RetryAfter, TelegramError
+from telegram.warnings import PTBUserWarning
 from telegram.ext import (
     ApplicationBuilder, ContextTypes, CommandHandler, 
-    MessageHandler, filters, ConversationHandler
+    MessageHandler, filters, ConversationHandler, CallbackQueryHandler, PicklePersistence, BaseUpdateProcessor
 )
 
 # Import our custom modules
 from .drive_manager import GoogleDriveManager
-from .ai_agent import GeminiAgent
+from .ai_agent import get_agent, trim_history, PLAN_MAX_TOKENS, ERROR_MESSAGE
 
 # Logging setup
 logging.basicConfig(
@@ -23,58 +31,556 @@ logger = logging.getLogger(__name__)
 # State Definitions for ConversationHandler
 (
     DRIVE_SETUP,
-    ONBOARDING_LANGUAGE,
-    ONBOARDING_TRANSLATION,
-    ONBOARDING_DENOMINATION,
-    ONBOARDING_STYLE,
-    ONBOARDING_PACING,
-    ONBOARDING_ORDERING,
+    ONBOARDING,
     IDLE,
     READING,
     DISCUSSION
-) = range(10)
+) = range(5)
+
+# Onboarding questions, asked in order within the single ONBOARDING state: (profile field, question)
+_ONBOARD_STEPS = (
+    ('language', "First, what is your preferred language?"),
+    ('translation', "Great. What is your preferred Bible translation? (e.g., ESV, NIV, KJV)"),
+    ('denomination', "What is your denominational or theological background? (This helps me tailor our discussions)"),
+    ('style', "How would you describe your preferred communication style? (e.g., Formal, Casual, Academic, Devotional)"),
+    ('pacing', "What is your preferred pacing? (e.g., 1 chapter/day, 15 mins/day)"),
+    ('ordering', "Finally, what is your preferred reading order? (e.g., Canonical, Chronological, Mix of OT/NT)"),
+)
+
+# /quickstart presets, one keyboard row per onboarding field
+_QUICKSTART_OPTIONS = (
+    ('language', ('English', 'Español', '中文')),
+    ('translation', ('ESV', 'NIV', 'KJV')),
+    ('denomination', ('General', 'Protestant', 'Catholic')),
+    ('style', ('Casual', 'Academic', 'Devotional')),
+    ('pacing', ('1 chapter/day', '15 mins/day')),
+    ('ordering', ('Canonical', 'Chronological')),
+)
+
+_QUICKSTART_CHOICES = dict(_QUICKSTART_OPTIONS)
+
+# Where PTB persists user_data and conversation states between runs
+BOT_STATE_PATH = os.environ.get('BOT_STATE_PATH', 'bot_state.pkl')
+
+# Updates processed at once across all users
+CONCURRENT_UPDATES = 256
+# Pooled keep-alive connections to the Bot API
+TELEGRAM_POOL_SIZE = 64
+# Simultaneous HTTPS connections Telegram may open to our webhook
+WEBHOOK_MAX_CONNECTIONS = 100
+
+# Body of every health check response, and how long a probe may take to send its request
+HEALTH_MESSAGE = b"Service is running."
+HEALTH_READ_TIMEOUT = 5.0
+
+# Longest text sent in one Telegram message (the API limit is 4096), leaving room for entities
+MESSAGE_LIMIT = 4000
+
+# Minimum seconds between edits of a streamed reply (Telegram rate-limits edits)
+STREAM_EDIT_INTERVAL = 0.6
+
+# Worker threads for blocking Drive calls; also caps how many Drive requests are in flight
+DRIVE_POOL_SIZE = int(os.environ.get('DRIVE_POOL', '64'))
+
+# Number of user folders kept in the in-memory Drive cache
+DRIVE_CACHE_SIZE = 256
+# The chat log is machine-only, so it is stored as (faster, smaller) JSON
+CHAT_HISTORY_FILE = 'chat_history.json'
+LEGACY_CHAT_HISTORY_FILE = 'chat_history.yaml'
+# Seconds a cached user-editable file is trusted before /read checks Drive for a newer version
+REVALIDATE_INTERVAL = 5 * 60
+# The user-editable files /read revalidates
+REVALIDATED_FILES = ('profile.yaml', 'reading_plan.yaml')
+# Discussion turns between chat history uploads
+CHAT_FLUSH_TURNS = 3
+# Seconds to coalesce dirty files before writing them back to Drive
+FLUSH_DELAY = 2.0
+
+# Seconds between sweeps of idle Gemini chat sessions
+SESSION_SWEEP_INTERVAL = 5 * 60
+
+# Plan days queued per background batch job: PLAN_BATCH_SLICES slices of PLAN_SLICE_DAYS days
+PLAN_BATCH_SLICES = 3
+PLAN_SLICE_DAYS = 7
+
+# History entries past which older turns are folded into the profile's rolling memory
+MEMORY_TRIGGER_ENTRIES = 10
+# Most recent history entries kept verbatim after a summarization
+MEMORY_KEEP_ENTRIES = 4
+
+# A plan line as Gemini tends to format it, e.g. "- **Day 3:** Genesis 5-6" or "Day 3-4: Genesis 5"
+_PLAN_LINE_RE = re.compile(
+    r"^[\s>*+\-]*(?:\d+[.)]\s*)?(?:\*\*|__)?\s*Day\s*(\d+)(?:\s*[-\u2013]\s*(\d+))?"
+    r"\s*(?:\*\*|__)?\s*[:\-\u2013]\s*(?:\*\*|__)?\s*(.+?)\s*$",
+    re.IGNORECASE
+)
+
+
+def _plan_entries(plan_text):
+    """Yields (first day, last day, reference, line) for every plan line, or None days for other lines."""
+    for line in plan_text.splitlines():
+        match = _PLAN_LINE_RE.match(line)
+        reference = match and match.group(3).strip('*_ ')
+        if not reference:
+            yield None, None, None, line
+            continue
+        first = int(match.group(1))
+        last = max(int(match.group(2) or first), first)
+        yield first, last, reference, line
+
+
+@functools.lru_cache(maxsize=DRIVE_CACHE_SIZE)
+def _plan_index(plan_body):
+    """Maps day number -> reference for every 'Day N: ref' line (first one wins), built once per plan.
+
+    Lines are matched whole, so Markdown decoration and "Day N-M" ranges (every day of the range gets
+    the reference) parse the same in plans written before _normalize_plan existed.
+    """
+    index = {}
+    for first, last, reference, _ in _plan_entries(plan_body):
+        if reference:
+            for day in range(first, last + 1):
+                index.setdefault(day, reference)
+    return index
+
+
+def _last_planned_day(plan_body):
+    """Returns the last day the plan covers (0 if none), counting "Day N-M" entries up to M.
+
+    Only whole plan lines count, so mentions like "see Day 3" don't extend the plan.
+    """
+    return max(_plan_index(plan_body), default=0)
+
+
+def _split_message(text, limit=None):
+    """Splits `text` into pieces of at most `limit` characters, preferring paragraph, then line breaks."""
+    limit = limit or MESSAGE_LIMIT
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n\n", 0, limit)
+        if cut <= 0:
+            cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut].rstrip())
+        text = text[cut:].lstrip("\n")
+    parts.append(text)
+    return parts
+
+
+def _normalize_plan(plan_text):
+    """Rewrites plan lines to the canonical 'Day N: Reference' (or 'Day N-M: Reference') form."""
+    lines = []
+    for first, last, reference, line in _plan_entries(plan_text):
+        if reference is None:
+            lines.append(line)
+        else:
+            days = f"{first}-{last}" if last > first else f"{first}"
+            lines.append(f"Day {days}: {reference}")
+    return "\n".join(lines)
+
+class _PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates concurrently across users but one at a time per user and chat.
+
+    The persistent ConversationHandler reads the state before a handler runs and stores the one it
+    returns; two overlapping updates from one user (e.g. /read while a reply is still streaming)
+    would otherwise overwrite each other's state.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        # (chat id, user id) -> asyncio.Lock; dropped once no update of that user is in flight
+        self._locks = weakref.WeakValueDictionary()
+
+    async def do_process_update(self, update, coroutine):
+        if not isinstance(update, Update) or update.effective_user is None:
+            await coroutine
+            return
+        key = (update.effective_chat.id if update.effective_chat else None, update.effective_user.id)
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        async with lock:
+            await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
 
 class BibleBot:
     def __init__(self, token, drive_manager, ai_agent):
-        self.application = ApplicationBuilder().token(token).build()
+        self.application = (
+            ApplicationBuilder()
+            .token(token)
+            # user_data (linked folder, profile, history) and conversation states survive restarts,
+            # so users don't have to /start again after every redeploy
+            .persistence(PicklePersistence(filepath=BOT_STATE_PATH))
+            # Let slow Gemini/Drive calls for one user overlap with other users' updates, while each
+            # user's own updates (and thus their conversation state) are handled in order
+            .concurrent_updates(_PerUserUpdateProcessor(CONCURRENT_UPDATES))
+            # Keep-alive HTTP/2 connections to api.telegram.org, multiplexing the many edit_message_text calls
+            .connection_pool_size(TELEGRAM_POOL_SIZE)
+            .http_version("2")
+            .get_updates_http_version("2")
+            .post_init(self._post_init)
+            .post_shutdown(self._post_shutdown)
+            .build()
+        )
         self.drive = drive_manager
         self.ai = ai_agent
+        # Drive calls get their own pool so they don't queue behind the small default executor
+        self._drive_executor = ThreadPoolExecutor(max_workers=DRIVE_POOL_SIZE, thread_name_prefix='drive')
+
+        # Write-behind Drive cache: folder_id -> {filename: {'file_id', 'data', 'dirty'}}, LRU ordered
+        self._drive_cache = OrderedDict()
+        # folder_id -> pending delayed flush task
+        self._pending_flushes = {}
+        self._session_sweeper = None
+        # Port to answer health checks on while polling (set by run() on Cloud Run)
+        self._health_port = None
+        self._health_server = None
+        # (folder_id, filename) -> asyncio.Lock serializing _update_cached
+        self._file_locks = {}
+        # Folders with a plan batch submission in flight
+        self._batch_submissions = set()
+        # Fire-and-forget tasks; the loop only keeps weak references, so they are held here until done
+        self._background_tasks = set()
         
         # Setup handlers
         self._setup_handlers()
 
     def _setup_handlers(self):
-        conv_handler = ConversationHandler(
-            entry_points=[CommandHandler('start', self.start)],
-            states={
-                DRIVE_SETUP: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.drive_setup_handler)],
-                ONBOARDING_LANGUAGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.onboarding_language)],
-                ONBOARDING_TRANSLATION: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.onboarding_translation)],
-                ONBOARDING_DENOMINATION: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.onboarding_denomination)],
-                ONBOARDING_STYLE: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.onboarding_style)],
-                ONBOARDING_PACING: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.onboarding_pacing)],
-                ONBOARDING_ORDERING: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.onboarding_ordering)],
-                IDLE: [CommandHandler('read', self.read_command)],
-                READING: [CommandHandler('done', self.done_command)],
-                DISCUSSION: [
-                    CommandHandler('read', self.read_command),
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, self.discussion_handler)
-                ],
-            },
-            fallbacks=[
-                CommandHandler('cancel', self.cancel),
-                CommandHandler('help', self.help_command)
-            ]
-        )
+        # The /quickstart keyboard belongs to the user's conversation, not to a single message, so
+        # per_message stays False; silence PTB's warning about that for this handler only
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", message="If 'per_message=False'", category=PTBUserWarning)
+            conv_handler = ConversationHandler(
+                name='main',
+                persistent=True,
+                per_message=False,
+                entry_points=[CommandHandler('start', self.start)],
+                states={
+                    DRIVE_SETUP: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.drive_setup_handler)],
+                    ONBOARDING: [
+                        CommandHandler('quickstart', self.quickstart_command),
+                        CallbackQueryHandler(self.quickstart_choice, pattern=r"^qs:"),
+                        MessageHandler(filters.TEXT & ~filters.COMMAND, self.onboarding_step)
+                    ],
+                    IDLE: [CommandHandler('read', self.read_command)],
+                    READING: [CommandHandler('done', self.done_command)],
+                    DISCUSSION: [
+                        CommandHandler('read', self.read_command),
+                        MessageHandler(filters.TEXT & ~filters.COMMAND, self.discussion_handler)
+                    ],
+                },
+                fallbacks=[
+                    CommandHandler('cancel', self.cancel),
+                    CommandHandler('help', self.help_command)
+                ]
+            )
         
         self.application.add_handler(conv_handler)
         # Add help handler globally for when not in a conversation
         self.application.add_handler(CommandHandler('help', self.help_command))
 
+    async def _post_init(self, application):
+        # Any blocking call not given an executor explicitly lands on the Drive pool,
+        # not the small min(32, cpu + 4) default one. Gemini calls run on the agent's own pool.
+        asyncio.get_running_loop().set_default_executor(self._drive_executor)
+        self._session_sweeper = asyncio.create_task(self._sweep_sessions())
+        if self._health_port:
+            self._health_server = asyncio.create_task(self._serve_health(self._health_port))
+
+    async def _post_shutdown(self, application):
+        if self._session_sweeper:
+            self._session_sweeper.cancel()
+        if self._health_server:
+            self._health_server.cancel()
+        # Let in-flight memory updates and prefetches land before the final flush
+        await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        await self._flush_all()
+        self._drive_executor.shutdown(wait=False)
+        self.ai.shutdown()
+
+    def _spawn(self, coro):
+        """Runs `coro` in the background, keeping a reference so it isn't garbage-collected mid-flight."""
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_task_done)
+        return task
+
+    def _background_task_done(self, task):
+        self._background_tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.error(f"Background task failed: {task.exception()}")
+
+    async def _sweep_sessions(self):
+        """Periodically drops idle Gemini chat sessions so they don't accumulate."""
+        while True:
+            await asyncio.sleep(SESSION_SWEEP_INTERVAL)
+            evicted = self.ai.evict_stale_sessions()
+            if evicted:
+                logger.info(f"Evicted {evicted} idle chat sessions")
+
+    async def _get_cached(self, folder_id, filename, known_ids=None):
+        """Returns the cache entry for `filename` in `folder_id`, loading it from Drive on a miss.
+
+        `known_ids` ({filename: file_id or None}, from _warm_file_ids) skips the name lookup,
+        including for files it found missing.
+        """
+        folder = self._drive_cache.get(folder_id)
+        if folder is None:
+            folder = self._drive_cache[folder_id] = {}
+            self._evict_folders()
+        self._drive_cache.move_to_end(folder_id)
+
+        entry = folder.get(filename)
+        if entry is None:
+            loop = asyncio.get_running_loop()
+            if known_ids is not None and filename in known_ids:
+                file_id = known_ids[filename]
+            else:
+                # Skip the executor hop when the Drive manager already knows the file ID
+                file_id = self.drive.cached_file_id(folder_id, filename) or await loop.run_in_executor(
+                    self._drive_executor, self.drive.get_file_id_by_name, folder_id, filename
+                )
+            data = version = None
+            if file_id:
+                read = loop.run_in_executor(self._drive_executor, self._reader(filename), file_id)
+                if filename in REVALIDATED_FILES:
+                    # The version revalidation compares against later; fetched alongside the content
+                    data, version = await asyncio.gather(read, loop.run_in_executor(
+                        self._drive_executor, self.drive.get_file_version, file_id
+                    ))
+                else:
+                    data = await read
+            entry = {'file_id': file_id, 'data': data, 'dirty': False, 'checked_at': time.monotonic(),
+                     'version': version}
+            # Don't pin a failed/empty read; retry it on the next access
+            if data is not None or not file_id:
+                folder[filename] = entry
+        return entry
+
+    async def _get_cached_many(self, folder_id, *filenames):
+        """Like _get_cached for several files, resolving uncached file IDs in one batched Drive request."""
+        known_ids = await self._warm_file_ids(folder_id, filenames)
+        return await asyncio.gather(*(self._get_cached(folder_id, name, known_ids) for name in filenames))
+
+    async def _warm_file_ids(self, folder_id, filenames):
+        """Resolves the IDs of uncached `filenames` with one batched lookup instead of one each.
+
+        Returns {filename: file_id or None} for the files looked up (empty if at most one needed it),
+        to pass on to _get_cached so it doesn't look them up again; files that don't exist aren't
+        remembered by the Drive manager, as the user may still create them.
+        """
+        folder = self._drive_cache.get(folder_id, {})
+        missing = [name for name in filenames if name not in folder]
+        if len(missing) <= 1:
+            return {}
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._drive_executor, self.drive.get_file_ids_by_name, folder_id, missing)
+
+    async def _revalidate(self, folder_id, filename):
+        """Drops a clean cached file if it changed on Drive (e.g. the user edited it by hand).
+
+        Only the file's version metadata is fetched; the content is re-read only when it changed.
+        """
+        entry = self._drive_cache.get(folder_id, {}).get(filename)
+        if not entry or entry['dirty'] or not entry['file_id']:
+            return
+        now = time.monotonic()
+        if now - entry.get('checked_at', now) < REVALIDATE_INTERVAL:
+            return
+        entry['checked_at'] = now
+
+        loop = asyncio.get_running_loop()
+        version = await loop.run_in_executor(self._drive_executor, self.drive.get_file_version, entry['file_id'])
+        if version is None:
+            return
+        # The entry holds the version it was loaded or last written at; unknown counts as changed
+        if entry.get('version') != version:
+            self._drive_cache[folder_id].pop(filename, None)
+
+    def _reader(self, filename):
+        """Machine-only files are stored as JSON; user-editable ones stay YAML."""
+        return self.drive.read_json_file if filename.endswith('.json') else self.drive.read_yaml_file
+
+    def _writer(self, filename):
+        return self.drive.write_json_file if filename.endswith('.json') else self.drive.write_yaml_file
+
+    async def _get_chat_history(self, folder_id):
+        """Cache entry for chat_history.json, migrating a legacy chat_history.yaml on first access."""
+        # Both names may need resolving; look them up together rather than one after the other
+        known_ids = await self._warm_file_ids(folder_id, (CHAT_HISTORY_FILE, LEGACY_CHAT_HISTORY_FILE))
+        entry = await self._get_cached(folder_id, CHAT_HISTORY_FILE, known_ids)
+        if entry['file_id']:
+            return entry
+        legacy = await self._get_cached(folder_id, LEGACY_CHAT_HISTORY_FILE, known_ids)
+        if legacy['file_id']:
+            # Reuse the legacy file: the next write stores JSON in it and renames it
+            folder = self._drive_cache.setdefault(folder_id, {})
+            folder.pop(LEGACY_CHAT_HISTORY_FILE, None)
+            entry = folder[CHAT_HISTORY_FILE] = dict(legacy)
+        return entry
+
+    def _store_cached(self, folder_id, filename, file_id, data):
+        """Records data that was just written to Drive."""
+        folder = self._drive_cache.setdefault(folder_id, {})
+        self._drive_cache.move_to_end(folder_id)
+        folder[filename] = {'file_id': file_id, 'data': data, 'dirty': False, 'checked_at': time.monotonic(),
+                            'version': self.drive.written_version(file_id)}
+        self._evict_folders()
+
+    async def _write_through(self, folder_id, filename, data):
+        """Writes `data` to Drive immediately and updates the cache."""
+        entry = await self._get_cached(folder_id, filename)
+        loop = asyncio.get_running_loop()
+        file_id = await loop.run_in_executor(
+            self._drive_executor,
+            lambda: self._writer(filename)(folder_id, filename, data, file_id=entry['file_id'])
+        )
+        self._store_cached(folder_id, filename, file_id or entry['file_id'], data)
+
+    async def _update_cached(self, folder_id, filename, mutate, write_through=True):
+        """Read-modify-write of a cached file: applies `mutate(data)` and saves the result.
+
+        Runs under a per-file lock so concurrent updates (e.g. /done and a background memory
+        summary) cannot interleave. `mutate` gets a copy, so if the write fails the cached data
+        (which handlers also hold, e.g. user_data['profile']) still matches Drive.
+        Returns the saved data.
+        """
+        lock = self._file_locks.setdefault((folder_id, filename), asyncio.Lock())
+        async with lock:
+            entry = await self._get_cached(folder_id, filename)
+            data = mutate(copy.deepcopy(entry['data']))
+            if write_through:
+                await self._write_through(folder_id, filename, data)
+            else:
+                self._write_behind(folder_id, filename, data)
+        return data
+
+    def _write_behind(self, folder_id, filename, data, flush=True):
+        """Updates the cache and schedules a coalesced flush to Drive.
+
+        With flush=False the file is only marked dirty; it is written by the next scheduled
+        flush of the folder (or on /cancel, eviction or shutdown).
+        """
+        folder = self._drive_cache.setdefault(folder_id, {})
+        entry = folder.setdefault(filename, {'file_id': None, 'data': None, 'dirty': False})
+        entry['data'] = data
+        entry['dirty'] = True
+        if flush:
+            self._schedule_flush(folder_id)
+
+    def _schedule_flush(self, folder_id):
+        """(Re)starts the debounced flush of `folder_id`'s dirty files."""
+        pending = self._pending_flushes.pop(folder_id, None)
+        if pending:
+            pending.cancel()
+        self._pending_flushes[folder_id] = asyncio.create_task(
+            self._flush_folder(folder_id, delay=FLUSH_DELAY)
+        )
+
+    async def _flush_folder(self, folder_id, folder=None, delay=0):
+        """Writes every dirty cached file of `folder_id` back to Drive."""
+        if delay:
+            await asyncio.sleep(delay)
+            # Past the debounce window; a newer turn must not cancel the write below
+            self._pending_flushes.pop(folder_id, None)
+
+        if folder is None:
+            folder = self._drive_cache.get(folder_id, {})
+        loop = asyncio.get_running_loop()
+
+        for filename, entry in list(folder.items()):
+            if not entry['dirty']:
+                continue
+            entry['dirty'] = False
+            data, file_id = entry['data'], entry['file_id']
+            try:
+                new_id = await loop.run_in_executor(
+                    self._drive_executor,
+                    lambda: self._writer(filename)(folder_id, filename, data, file_id=file_id)
+                )
+                entry['file_id'] = new_id or file_id
+                # Our own write bumps the Drive version; don't mistake it for a user edit
+                entry['version'] = self.drive.written_version(entry['file_id'])
+            except Exception as e:
+                entry['dirty'] = True
+                logger.error(f"Error flushing {filename} for folder {folder_id}: {e}")
+
+    async def _invalidate_folder(self, folder_id):
+        """Flushes pending writes for `folder_id` and drops it from the cache."""
+        pending = self._pending_flushes.pop(folder_id, None)
+        if pending:
+            pending.cancel()
+        folder = self._drive_cache.pop(folder_id, None)
+        if folder:
+            await self._flush_folder(folder_id, folder)
+
+    async def _flush_all(self):
+        """Flushes every dirty folder (run on shutdown)."""
+        for folder_id in list(self._drive_cache):
+            await self._invalidate_folder(folder_id)
+
+    def _evict_folders(self):
+        while len(self._drive_cache) > DRIVE_CACHE_SIZE:
+            folder_id, folder = self._drive_cache.popitem(last=False)
+            for filename in folder:
+                lock = self._file_locks.get((folder_id, filename))
+                if lock and not lock.locked():
+                    del self._file_locks[(folder_id, filename)]
+            if any(entry['dirty'] for entry in folder.values()):
+                self._spawn(self._flush_folder(folder_id, folder))
+
+    async def _poll_batch(self, folder_id, plan_data):
+        """Merges a finished background plan batch into `plan_data`, if one is pending."""
+        job_name = plan_data.get('pending_batch')
+        if not job_name:
+            return
+
+        slices = await self.ai.apoll_plan_batch(job_name)
+        if slices is None:
+            return
+
+        del plan_data['pending_batch']
+        for start_day, text in sorted(slices.items()):
+            # Skip slices already covered by a synchronous extension
+            if start_day > _last_planned_day(plan_data['plan']):
+                plan_data['plan'] += f"\n\n{_normalize_plan(text)}"
+        await self._write_through(folder_id, 'reading_plan.yaml', plan_data)
+
+    def _prefetch_plan(self, folder_id, profile, plan_data, current_day):
+        """Queues the next weeks of the plan on the Batch API when less than a week is left."""
+        if not self.ai.supports_plan_batches:
+            return
+        if plan_data.get('pending_batch') or folder_id in self._batch_submissions:
+            return
+        last_day = _last_planned_day(plan_data['plan'])
+        if last_day - current_day < PLAN_SLICE_DAYS:
+            self._spawn(self._submit_plan_batch(folder_id, dict(profile), plan_data, last_day + 1))
+
+    async def _submit_plan_batch(self, folder_id, profile, plan_data, start_day):
+        self._batch_submissions.add(folder_id)
+        try:
+            start_days = [start_day + i * PLAN_SLICE_DAYS for i in range(PLAN_BATCH_SLICES)]
+            job_name = await self.ai.asubmit_plan_batch(profile, start_days)
+            if job_name:
+                plan_data['pending_batch'] = job_name
+                await self._write_through(folder_id, 'reading_plan.yaml', plan_data)
+        except Exception as e:
+            logger.error(f"Error submitting plan batch for folder {folder_id}: {e}")
+        finally:
+            self._batch_submissions.discard(folder_id)
+
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         help_text = (
             "**Bible Companion Commands**\n\n"
             "/start - Begin your journey and set up your profile\n"
+            "/quickstart - Answer the setup questions with presets\n"
             "/read - Get today's reading\n"
             "/done - Mark reading as complete and discuss\n"
             "/cancel - Cancel current operation\n"
@@ -91,7 +597,7 @@ class BibleBot:
             "If you are using a **Personal Google Account**, you must create 3 empty files in the folder for me to use (due to Google permission rules):\n"
             "- `profile.yaml`\n"
             "- `reading_plan.yaml`\n"
-            "- `chat_history.yaml`\n\n"
+            "- `chat_history.json`\n\n"
             "If you are using a **Shared Drive (Workspace)**, you don't need to create these files.\n\n"
             "1. Share the folder with my email:\n"
             f"`{email}`\n"
@@ -108,7 +614,7 @@ class BibleBot:
         try:
             # Offload blocking call
             await loop.run_in_executor(
-                None, self.drive.list_files_in_folder, folder_id
+                self._drive_executor, self.drive.list_files_in_folder, folder_id
             )
         except Exception as e:
             await update.message.reply_text(
@@ -118,16 +624,18 @@ class BibleBot:
             return DRIVE_SETUP
 
         context.user_data['drive_folder_id'] = folder_id
+        # Re-linking a folder always starts from what is actually on Drive
+        await self._invalidate_folder(folder_id)
         
         # Check for existing profile
         profile_id = await loop.run_in_executor(
-            None, self.drive.get_file_id_by_name, folder_id, 'profile.yaml'
+            self._drive_executor, self.drive.get_file_id_by_name, folder_id, 'profile.yaml'
         )
         
         # Logic to determine if we are onboarding or returning
         if profile_id:
             # Read the profile to check if it's populated or just an empty placeholder
-            profile_data = await loop.run_in_executor(None, self.drive.read_yaml_file, profile_id)
+            profile_data = await loop.run_in_executor(self._drive_executor, self.drive.read_yaml_file, profile_id)
 
             # If it has data, welcome back
             if profile_data:
@@ -138,28 +646,32 @@ class BibleBot:
             await update.message.reply_text(
                 "Access confirmed! I see your empty profile.yaml.\n"
                 "I am your personal Bible Reading Companion, designed to help you read and understand the scriptures.\n\n"
-                "To create a customized reading plan for you, I need to ask a few questions.\n\n"
-                "First, what is your preferred language?"
+                "To create a customized reading plan for you, I need to ask a few questions "
+                "(or send /quickstart to pick from presets).\n\n"
+                f"{_ONBOARD_STEPS[0][1]}"
             )
-            return ONBOARDING_LANGUAGE
+            self._start_onboarding(context)
+            return ONBOARDING
         else:
             # Profile doesn't exist. Try to create a test file to check for "Quota" issue.
             try:
                 test_file_id = await loop.run_in_executor(
-                    None,
+                    self._drive_executor,
                     lambda: self.drive.write_yaml_file(folder_id, 'bot_test_permission.yaml', {"test": "data"})
                 )
                 # If success, we have write access (Shared Drive or other). Clean up.
                 if test_file_id:
-                    await loop.run_in_executor(None, self.drive.delete_file, test_file_id)
+                    await loop.run_in_executor(self._drive_executor, self.drive.delete_file, test_file_id)
 
                 await update.message.reply_text(
                     "Access confirmed!\n"
                     "I am your personal Bible Reading Companion, designed to help you read and understand the scriptures.\n\n"
-                    "To create a customized reading plan for you, I need to ask a few questions.\n\n"
-                    "First, what is your preferred language?"
+                    "To create a customized reading plan for you, I need to ask a few questions "
+                    "(or send /quickstart to pick from presets).\n\n"
+                    f"{_ONBOARD_STEPS[0][1]}"
                 )
-                return ONBOARDING_LANGUAGE
+                self._start_onboarding(context)
+                return ONBOARDING
 
             except Exception as e:
                 # Catch Quota/Permission errors specifically
@@ -171,7 +683,7 @@ class BibleBot:
                         "Please manually create these **empty files** inside your folder:\n"
                         "1. `profile.yaml`\n"
                         "2. `reading_plan.yaml`\n"
-                        "3. `chat_history.yaml`\n\n"
+                        "3. `chat_history.json`\n\n"
                         "After you have created them, paste the **Folder ID** again."
                     )
                     return DRIVE_SETUP
@@ -180,73 +692,94 @@ class BibleBot:
                     await update.message.reply_text(f"Error checking write permissions: {e}")
                     return DRIVE_SETUP
 
-    async def onboarding_language(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        context.user_data['language'] = update.message.text
-        await update.message.reply_text("Great. What is your preferred Bible translation? (e.g., ESV, NIV, KJV)")
-        return ONBOARDING_TRANSLATION
-
-    async def onboarding_translation(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        context.user_data['translation'] = update.message.text
-        await update.message.reply_text("What is your denominational or theological background? (This helps me tailor our discussions)")
-        return ONBOARDING_DENOMINATION
-
-    async def onboarding_denomination(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        context.user_data['denomination'] = update.message.text
-        await update.message.reply_text("How would you describe your preferred communication style? (e.g., Formal, Casual, Academic, Devotional)")
-        return ONBOARDING_STYLE
-
-    async def onboarding_style(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        context.user_data['style'] = update.message.text
-        await update.message.reply_text("What is your preferred pacing? (e.g., 1 chapter/day, 15 mins/day)")
-        return ONBOARDING_PACING
-
-    async def onboarding_pacing(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        context.user_data['pacing'] = update.message.text
-        await update.message.reply_text("Finally, what is your preferred reading order? (e.g., Canonical, Chronological, Mix of OT/NT)")
-        return ONBOARDING_ORDERING
-
-    async def onboarding_ordering(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        context.user_data['ordering'] = update.message.text
-        
+    def _start_onboarding(self, context):
+        """Starts the questions from the top, dropping answers persisted from an earlier, unfinished run."""
+        for field, _ in _ONBOARD_STEPS:
+            context.user_data.pop(field, None)
+        context.user_data['_onboard_idx'] = 0
+
+    async def onboarding_step(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Stores the answer to the current onboarding question and asks the next one."""
+        idx = context.user_data.get('_onboard_idx', 0)
+        context.user_data[_ONBOARD_STEPS[idx][0]] = update.message.text
+
+        idx += 1
+        if idx < len(_ONBOARD_STEPS):
+            context.user_data['_onboard_idx'] = idx
+            await update.message.reply_text(_ONBOARD_STEPS[idx][1])
+            return ONBOARDING
+
+        context.user_data.pop('_onboard_idx', None)
+        return await self._finalize_profile(update, context)
+
+    async def quickstart_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Offers every onboarding question at once as preset buttons."""
+        keyboard = [
+            [InlineKeyboardButton(value, callback_data=f"qs:{field}:{value}") for value in values]
+            for field, values in _QUICKSTART_OPTIONS
+        ]
+        await update.message.reply_text(
+            "Quick setup: pick one option in each row (or keep answering the questions by text).",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+        return ONBOARDING
+
+    async def quickstart_choice(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Records a /quickstart button press; finishes onboarding once every field is set."""
+        query = update.callback_query
+        _, field, value = (query.data.split(':', 2) + ['', ''])[:3]
+        # Callback data comes from the client; only accept the presets the keyboard offers
+        if value not in _QUICKSTART_CHOICES.get(field, ()):
+            logger.warning(f"Ignoring unknown quickstart choice {query.data!r}")
+            await query.answer()
+            return ONBOARDING
+        context.user_data[field] = value
+        await query.answer(f"{field.capitalize()}: {value}")
+
+        if any(field not in context.user_data for field, _ in _ONBOARD_STEPS):
+            return ONBOARDING
+        await query.edit_message_reply_markup(reply_markup=None)
+        context.user_data.pop('_onboard_idx', None)
+        return await self._finalize_profile(update, context)
+
+    async def _finalize_profile(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Saves the collected onboarding answers and generates the first reading plan."""
+        # Reached from a text answer or a /quickstart button press
+        message = update.effective_message
         # Save Profile to Drive
-        profile_data = {
-            'language': context.user_data['language'],
-            'translation': context.user_data['translation'],
-            'denomination': context.user_data['denomination'],
-            'style': context.user_data['style'],
-            'pacing': context.user_data['pacing'],
-            'ordering': context.user_data['ordering'],
-            'current_day': 1
-        }
+        profile_data = {field: context.user_data[field] for field, _ in _ONBOARD_STEPS}
+        profile_data['current_day'] = 1
         
         folder_id = context.user_data['drive_folder_id']
         loop = asyncio.get_running_loop()
 
         # Offload blocking calls
-        await loop.run_in_executor(
-            None, 
+        profile_id = await loop.run_in_executor(
+            self._drive_executor, 
             lambda: self.drive.write_yaml_file(folder_id, 'profile.yaml', profile_data)
         )
+        self._store_cached(folder_id, 'profile.yaml', profile_id, profile_data)
         
         # Generate initial plan using AI
-        await update.message.reply_text("Thank you! I am generating your first reading plan...")
+        await message.reply_text("Thank you! I am generating your first reading plan...")
         
-        # AI call might be slow too, good to offload
-        plan_text = await loop.run_in_executor(
-            None, self.ai.generate_reading_plan, str(profile_data)
-        )
+        plan_text = await self.ai.agenerate_reading_plan(str(profile_data))
+        plan_text = _normalize_plan(plan_text)
         
         plan_data = {
             'generated_at': 'now',
             'plan': plan_text
         }
 
-        await loop.run_in_executor(
-            None, 
+        plan_id = await loop.run_in_executor(
+            self._drive_executor, 
             lambda: self.drive.write_yaml_file(folder_id, 'reading_plan.yaml', plan_data)
         )
+        self._store_cached(folder_id, 'reading_plan.yaml', plan_id, plan_data)
+        # The first week is generated synchronously; the following weeks go through the Batch API
+        self._prefetch_plan(folder_id, profile_data, plan_data, 1)
         
-        await update.message.reply_text(f"Setup Complete! Here is your plan:\n\n{plan_text}\n\nType /read to begin.")
+        await message.reply_text(f"Setup Complete! Here is your plan:\n\n{plan_text}\n\nType /read to begin.")
         return IDLE
 
     async def read_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -255,15 +788,15 @@ class BibleBot:
             await update.message.reply_text("Please run /start to set up your profile first.")
             return ConversationHandler.END
 
-        loop = asyncio.get_running_loop()
-
-        # Get Profile
-        file_id = await loop.run_in_executor(None, self.drive.get_file_id_by_name, folder_id, 'profile.yaml')
-        if not file_id:
+        # Get Profile and Reading Plan (independent, so fetched concurrently),
+        # picking up any edits the user made to them on Drive
+        await asyncio.gather(*(self._revalidate(folder_id, filename) for filename in REVALIDATED_FILES))
+        profile_entry, plan_entry = await self._get_cached_many(folder_id, 'profile.yaml', 'reading_plan.yaml')
+        if not profile_entry['file_id']:
             await update.message.reply_text("Profile not found. Please run /start.")
             return ConversationHandler.END
             
-        profile = await loop.run_in_executor(None, self.drive.read_yaml_file, file_id)
+        profile = profile_entry['data']
         if not profile:
             await update.message.reply_text("Error reading profile. Please try again.")
             return ConversationHandler.END
@@ -273,131 +806,306 @@ class BibleBot:
         # Store profile in user_data for discussion context
         context.user_data['profile'] = profile
         
-        # Get Reading Plan
-        plan_id = await loop.run_in_executor(None, self.drive.get_file_id_by_name, folder_id, 'reading_plan.yaml')
-        plan_data = await loop.run_in_executor(None, self.drive.read_yaml_file, plan_id)
-        
+        plan_data = plan_entry['data']
         if not plan_data or not plan_data.get('plan'):
             await update.message.reply_text("Error: Reading plan is empty or missing. Please contact support or restart.")
             return ConversationHandler.END
 
+        self._flush_chat_history(context, folder_id)
+
+        # Pick up plan slices generated in the background, if they are ready
+        await self._poll_batch(folder_id, plan_data)
         plan_body = plan_data['plan']
 
-        # Determine today's reading (naive parsing for now, assuming line by line or Day X format)
-        # Check if the plan covers the current day
-        if f"Day {current_day}:" not in plan_body and f"Day {current_day} " not in plan_body:
+        # Check if the plan covers the current day, by its "Day N: ref" entries rather than a
+        # substring test (which also matched e.g. "see Day 3 notes")
+        if _last_planned_day(plan_body) < current_day:
              await update.message.reply_text("Your current reading plan has ended. Generating the next part of your plan...")
              
              # Generate next 7 days
+             # Stable preferences/format first, the changing day range last (prefix caching)
              extension_prompt = (
-                 f"The user is on Day {current_day}. "
-                 f"Generate a daily Bible reading plan for Day {current_day} to Day {current_day + 6}. "
                  f"Context/Preferences: {str(profile)}\n"
-                 "Format the output as a Markdown list with 'Day X: Book Chapter:Verse'."
-             )
-             new_plan_part = await loop.run_in_executor(
-                 None, self.ai.generate_response, extension_prompt
+                 "Format the output as a Markdown list with 'Day X: Book Chapter:Verse'.\n"
+                 f"The user is on Day {current_day}. "
+                 f"Generate a daily Bible reading plan for Day {current_day} to Day {current_day + 6}."
              )
+             new_plan_part = await self.ai.agenerate_response(extension_prompt, max_tokens=PLAN_MAX_TOKENS)
+             new_plan_part = _normalize_plan(new_plan_part)
              
              # Append to existing plan
              plan_body += f"\n\n{new_plan_part}"
              plan_data['plan'] = plan_body
-             await loop.run_in_executor(
-                 None, 
-                 lambda: self.drive.write_yaml_file(folder_id, 'reading_plan.yaml', plan_data, file_id=plan_id)
-             )
+             await self._write_through(folder_id, 'reading_plan.yaml', plan_data)
+
+        self._prefetch_plan(folder_id, profile, plan_data, current_day)
 
-        # In a real scenario, we'd parse 'plan_body' to find the specific verses.
-        # Here we ask Gemini to extract/confirm the reading for Day X from the plan text.
-        extraction_prompt = f"From this plan:\n{plan_body}\n\nWhat is the reading for Day {current_day}? Return ONLY the Bible reference."
-        reading_ref = await loop.run_in_executor(None, self.ai.generate_response, extraction_prompt)
+        # Look today's reference up in the plan; only ask Gemini if the line is not in 'Day N: ref' form
+        reading_ref = _plan_index(plan_body).get(current_day)
+        if not reading_ref:
+            # Send only the lines that can mention today, not the whole (growing) plan
+            excerpt = "\n".join(line for line in plan_body.splitlines() if str(current_day) in line) or plan_body
+            extraction_prompt = f"From this plan:\n{excerpt}\n\nWhat is the reading for Day {current_day}? Return ONLY the Bible reference."
+            reading_ref = await self.ai.agenerate_response(extraction_prompt)
         reading_ref = reading_ref.strip()
         
-        # Fetch Text
-        scripture_text = await loop.run_in_executor(
-            None, 
-            lambda: self.ai.get_bible_text(reading_ref, translation=profile.get('translation', 'ESV'))
-        )
+        # Fetch Text (reusing the copy prefetched after yesterday's /done, if it matches)
+        prefetched = context.user_data.pop('prefetched_scripture', None) or {}
+        cached_ref, scripture_text = prefetched.get(current_day, (None, None))
+        if cached_ref != reading_ref or not scripture_text:
+            scripture_text = await self.ai.aget_bible_text(reading_ref, translation=profile.get('translation', 'ESV'))
         
         context.user_data['current_reading_ref'] = reading_ref
         context.user_data['current_scripture'] = scripture_text
+        # A new reading means a new discussion context
+        self.ai.reset_session(update.effective_user.id)
         
-        await update.message.reply_text(f"**Day {current_day}: {reading_ref}**\n\n{scripture_text}\n\nWhen you are finished reading, type /done.")
+        await self._send_chunked(
+            update.message,
+            f"**Day {current_day}: {reading_ref}**\n\n{scripture_text}\n\nWhen you are finished reading, type /done."
+        )
+
+        # Cache the persona + reading once so every discussion turn reuses it. Created in the
+        # background so /read doesn't wait on it; turns before it is ready send the reading inline
+        context.user_data.pop('cache_name', None)
+        self._spawn(self._cache_reading(context, scripture_text, profile))
         return READING
 
+    async def _cache_reading(self, context, scripture_text, profile):
+        """Creates the context cache for today's reading and hands it to later discussion turns."""
+        cache_name = await self.ai.acreate_reading_cache(scripture_text, profile=profile)
+        # Unless a newer /read, /done or memory update replaced what the cache was built from
+        if (cache_name and context.user_data.get('current_scripture') is scripture_text
+                and context.user_data.get('profile') is profile):
+            context.user_data['cache_name'] = cache_name
+
     async def done_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         folder_id = context.user_data.get('drive_folder_id')
-        loop = asyncio.get_running_loop()
-        
-        # Update Progress in Profile
-        file_id = await loop.run_in_executor(None, self.drive.get_file_id_by_name, folder_id, 'profile.yaml')
-        profile = await loop.run_in_executor(None, self.drive.read_yaml_file, file_id)
         
-        profile['current_day'] = profile.get('current_day', 1) + 1
-        await loop.run_in_executor(
-            None, 
-            lambda: self.drive.write_yaml_file(folder_id, 'profile.yaml', profile, file_id=file_id)
-        )
+        # Update Progress in Profile (written through: progress must not be lost)
+        def advance(profile):
+            profile['current_day'] = profile.get('current_day', 1) + 1
+            return profile
+        try:
+            profile = await self._update_cached(folder_id, 'profile.yaml', advance)
+        except Exception as e:
+            logger.error(f"Error saving progress for folder {folder_id}: {e}")
+            await update.message.reply_text("I couldn't save your progress. Please send /done again.")
+            return READING
+        context.user_data['profile'] = profile
         
-        # Initialize Chat History for this session
+        # Save the previous discussion's unsaved turns, then start a new one
+        self._flush_chat_history(context, folder_id)
         context.user_data['chat_history'] = []
+        self.ai.reset_session(update.effective_user.id)
         
         await update.message.reply_text("Great job! What stood out to you in today's reading? Let's talk about it.")
+
+        # The next /read is predictable; fetch its text while the user is discussing this one
+        self._spawn(self._prefetch_tomorrow(context, folder_id, profile))
         return DISCUSSION
 
+    def _flush_chat_history(self, context, folder_id):
+        """Schedules the upload of chat turns the discussion handler left unsaved."""
+        if context.user_data.pop('unsaved_turns', 0):
+            self._schedule_flush(folder_id)
+
+    async def _prefetch_tomorrow(self, context, folder_id, profile):
+        """Fetches the scripture for the profile's (new) current day into user_data."""
+        day = profile.get('current_day', 1)
+        try:
+            plan_data = (await self._get_cached(folder_id, 'reading_plan.yaml'))['data']
+            reading_ref = plan_data and _plan_index(plan_data.get('plan', '')).get(day)
+            if not reading_ref:
+                return
+            text = await self.ai.aget_bible_text(reading_ref, translation=profile.get('translation', 'ESV'))
+            if text and text != ERROR_MESSAGE:
+                context.user_data['prefetched_scripture'] = {day: (reading_ref, text)}
+        except Exception as e:
+            logger.error(f"Error prefetching scripture for folder {folder_id}: {e}")
+
     async def discussion_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_input = update.message.text
         reading_context = context.user_data.get('current_scripture', 'The Bible')
         profile = context.user_data.get('profile', {})
-        loop = asyncio.get_running_loop()
         folder_id = context.user_data.get('drive_folder_id')
 
         # Retrieve persistent chat history
         # 1. Try memory
         history = context.user_data.get('chat_history')
         
-        # 2. If missing, try Drive
-        chat_file_id = await loop.run_in_executor(None, self.drive.get_file_id_by_name, folder_id, 'chat_history.yaml')
+        # 2. If missing, try the Drive cache (loads from Drive on a miss).
+        # When history is already in memory the lookup overlaps with generation.
+        chat_task = asyncio.create_task(self._get_chat_history(folder_id))
         
         if history is None:
-            if chat_file_id:
-                data = await loop.run_in_executor(None, self.drive.read_yaml_file, chat_file_id)
-                history = data.get('history', []) if data else []
-            else:
-                history = []
+            data = (await chat_task)['data']
+            history = data.get('history', []) if data else []
 
-        # Generate Response using existing history
-        response = await loop.run_in_executor(
-            None, 
-            lambda: self.ai.discuss_reading(user_input, list(history), reading_context, profile=profile)
+        # Stream the response into a placeholder message as it is generated
+        placeholder = await update.message.reply_text("…")
+        chunks = self.ai.adiscuss_reading_stream(
+            user_input, list(history), reading_context,
+            profile=profile, cache_name=context.user_data.get('cache_name'),
+            session_key=update.effective_user.id
         )
+        response = await self._stream_reply(context, placeholder, chunks)
+        chat_entry = await chat_task
         
         # Append User input and Model response to history
         history.append({'role': 'user', 'parts': [user_input]})
         history.append({'role': 'model', 'parts': [response]})
         
-        # Keep window small (last 10 turns)
-        if len(history) > 10:
-            history = history[-10:]
+        # Fold older turns into a compact memory note (in the background) instead of dropping them
+        if len(history) > MEMORY_TRIGGER_ENTRIES:
+            older, history = history[:-MEMORY_KEEP_ENTRIES], history[-MEMORY_KEEP_ENTRIES:]
+            self._spawn(self._update_memory(context, folder_id, update.effective_user.id, older))
+
+        # Keep the window within a token budget rather than a fixed number of turns
+        history = trim_history(history)
 
         context.user_data['chat_history'] = history
         
         # Persist Chat Log to Drive
-        # We save the structured history in YAML
-        chat_data = {'created': 'now' if not chat_file_id else 'existing', 'history': history}
-
-        await loop.run_in_executor(
-            None,
-            lambda: self.drive.write_yaml_file(folder_id, 'chat_history.yaml', chat_data, file_id=chat_file_id)
-        )
+        # We save the structured history as JSON; the write is coalesced in the background.
+        # Drive can only replace file contents, but the file is just the bounded window above
+        # (older turns live in the profile's rolling memory), so each upload stays small.
+        # It is uploaded every CHAT_FLUSH_TURNS turns and on /read, /done and /cancel, not every turn.
+        unsaved = context.user_data.get('unsaved_turns', 0) + 1
+        flush = unsaved >= CHAT_FLUSH_TURNS
+        context.user_data['unsaved_turns'] = 0 if flush else unsaved
+        chat_data = {'created': 'now' if not chat_entry['file_id'] else 'existing', 'history': history}
+        self._write_behind(folder_id, CHAT_HISTORY_FILE, chat_data, flush=flush)
 
-        await update.message.reply_text(response)
         return DISCUSSION
 
+    async def _update_memory(self, context, folder_id, session_key, turns):
+        """Summarizes `turns` into the profile's `rolling_memory` and persists it."""
+        try:
+            profile = (await self._get_cached(folder_id, 'profile.yaml'))['data']
+            if not profile:
+                return
+            summary = await self.ai.asummarize_history(turns, profile.get('rolling_memory'))
+            if not summary:
+                return
+            def remember(profile):
+                profile['rolling_memory'] = summary
+                return profile
+            context.user_data['profile'] = await self._update_cached(
+                folder_id, 'profile.yaml', remember, write_through=False
+            )
+            # The reading's context cache was built with the old memory and holds none of the
+            # summarized turns; send the persona and reading inline (with the new memory) from now on
+            context.user_data.pop('cache_name', None)
+            # Rebuild the chat session from the memory + recent turns on the next message
+            self.ai.reset_session(session_key)
+        except Exception as e:
+            logger.error(f"Error updating rolling memory for folder {folder_id}: {e}")
+
+    async def _send_chunked(self, message, text):
+        """Replies to `message` with `text`, split into several messages if it is over MESSAGE_LIMIT."""
+        # Sent one after another so the parts arrive in order
+        for part in _split_message(text):
+            await message.reply_text(part)
+
+    async def _stream_reply(self, context, message, chunks):
+        """Streams an async chunk iterator into `message`, editing it as text arrives.
+
+        Edits are throttled to STREAM_EDIT_INTERVAL. Returns the full response text.
+        """
+        buf = ""
+        sent = ""
+        last_edit = time.monotonic()
+
+        async for chunk in chunks:
+            buf += chunk
+            now = time.monotonic()
+            if now - last_edit >= STREAM_EDIT_INTERVAL and buf.strip() and len(buf) <= MESSAGE_LIMIT:
+                sent = await self._edit_reply(context, message, buf, sent)
+                last_edit = now
+
+        if not buf.strip():
+            buf = ERROR_MESSAGE
+        # A reply over Telegram's limit keeps its first part in the placeholder; the rest follows
+        first, *rest = _split_message(buf)
+        await self._edit_reply(context, message, first, sent, final=True)
+        for part in rest:
+            await self._send_part(context, message, part)
+        return buf
+
+    async def _edit_reply(self, context, message, text, sent, final=False):
+        """Edits `message` to `text` unless unchanged; returns the text now shown.
+
+        A failed intermediate edit is skipped (the next one catches up); the final edit is retried once.
+        """
+        if text == sent:
+            return sent
+        for attempt in range(2 if final else 1):
+            try:
+                await context.bot.edit_message_text(
+                    chat_id=message.chat_id,
+                    message_id=message.message_id,
+                    text=text
+                )
+                return text
+            except BadRequest as e:
+                # e.g. the message was deleted; retrying won't help
+                logger.warning(f"Could not edit streamed reply: {e}")
+                return sent
+            except RetryAfter as e:
+                logger.warning(f"Streamed reply edit flood-limited for {e.retry_after}s")
+                if final and not attempt:
+                    await asyncio.sleep(e.retry_after)
+            except TelegramError as e:
+                logger.warning(f"Could not edit streamed reply: {e}")
+        return sent
+
+    async def _send_part(self, context, message, text):
+        """Sends a follow-up part of a streamed reply, retrying once if flood-limited.
+
+        A part that still can't be sent is skipped, so the turn (and its history) is kept.
+        """
+        for attempt in range(2):
+            try:
+                await context.bot.send_message(chat_id=message.chat_id, text=text)
+                return
+            except RetryAfter as e:
+                logger.warning(f"Streamed reply part flood-limited for {e.retry_after}s")
+                if not attempt:
+                    await asyncio.sleep(e.retry_after)
+            except TelegramError as e:
+                logger.warning(f"Could not send streamed reply part: {e}")
+                return
+
     async def cancel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        folder_id = context.user_data.get('drive_folder_id')
+        if folder_id:
+            await self._invalidate_folder(folder_id)
         await update.message.reply_text("Operation cancelled.")
         return ConversationHandler.END
 
+    async def _serve_health(self, port):
+        """Answers Cloud Run health checks on `port` from the event loop, handling probes concurrently."""
+        async def handle(reader, writer):
+            try:
+                # Drain the request head; any request gets the same answer
+                await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=HEALTH_READ_TIMEOUT)
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\n"
+                    b"Content-Length: " + str(len(HEALTH_MESSAGE)).encode() + b"\r\nConnection: close\r\n\r\n"
+                    + HEALTH_MESSAGE
+                )
+                await writer.drain()
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                pass
+            finally:
+                writer.close()
+
+        server = await asyncio.start_server(handle, port=port, reuse_address=True)
+        logger.info(f"Serving health check on port {port}")
+        async with server:
+            await server.serve_forever()
+
     def run(self):
         webhook_url = os.environ.get('WEBHOOK_URL')
         port = int(os.environ.get('PORT', '8080'))
@@ -409,32 +1117,32 @@ class BibleBot:
                 listen="0.0.0.0",
                 port=port,
                 webhook_url=webhook_url,
-                allowed_updates=Update.ALL_TYPES
+                allowed_updates=Update.ALL_TYPES,
+                max_connections=WEBHOOK_MAX_CONNECTIONS
             )
         elif is_cloud_run:
-            logger.warning(f"WEBHOOK_URL not set. Detected Cloud Run environment. Starting dummy server on port {port} to pass health check.")
-
-            class HealthCheckHandler(http.server.SimpleHTTPRequestHandler):
-                def do_GET(self):
-                    self.send_response(200)
-                    self.send_header('Content-type', 'text/plain')
-                    self.end_headers()
-                    self.wfile.write(b"Service is running. Please set WEBHOOK_URL to enable the bot.")
-
-            # Allow address reuse to avoid 'Address already in use' errors during restarts
-            socketserver.TCPServer.allow_reuse_address = True
-            with socketserver.TCPServer(("", port), HealthCheckHandler) as httpd:
-                logger.info(f"Serving health check on port {port}")
-                httpd.serve_forever()
+            logger.warning(f"WEBHOOK_URL not set. Detected Cloud Run environment. Polling, with a health check on port {port}.")
+            logger.warning("Polling on Cloud Run needs --min-instances 1 --max-instances 1 --no-cpu-throttling; "
+                           "set WEBHOOK_URL to use webhook mode instead (see README).")
+            # The health server runs on the bot's own event loop (started in _post_init)
+            self._health_port = port
+            self.application.run_polling()
         else:
             logger.info("Starting in Polling mode...")
             self.application.run_polling()
 
 if __name__ == '__main__':
+    # uvloop is only installed where it builds (see requirements.txt); elsewhere use the stock event loop
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+
     # Initialize Dependencies
     token = os.environ.get('TELEGRAM_TOKEN')
     drive = GoogleDriveManager()
-    ai = GeminiAgent()
+    ai = get_agent()
     
     if not token:
         logger.error("No TELEGRAM_TOKEN found!")
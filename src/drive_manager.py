@@ -1,18 +1,71 @@
 import os
 import yaml
+import orjson
 import logging
+import threading
+import time
+import httplib2
+import httpx
+import google_auth_httplib2
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload, MediaIoBaseDownload
-import io
+from googleapiclient.http import MediaInMemoryUpload
 
 logger = logging.getLogger(__name__)
 
+# libyaml's C parser/emitter when PyYAML was built with it (several times faster), else pure Python
+_YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+_YamlDumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+# Uploads at least this large use a resumable session; smaller ones go in a single multipart request
+RESUMABLE_UPLOAD_MIN_BYTES = 5 * 1024 * 1024
+
+# Seconds before a Drive HTTP request is abandoned
+DRIVE_HTTP_TIMEOUT = 60.0
+
+# Seconds a (folder, filename) -> file ID lookup is trusted; users may rename or recreate files
+NAME_CACHE_TTL_SECONDS = 5 * 60
+
+class _Http2Transport:
+    """httplib2.Http look-alike that sends googleapiclient's requests through a shared httpx client.
+
+    httplib2 speaks HTTP/1.1 with a connection per Http object; one HTTP/2 client lets every
+    worker thread multiplex its Drive calls over the same connection.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self.timeout = None
+        self.follow_redirects = True
+        self.redirect_codes = frozenset((301, 302, 303, 307, 308))
+        self.connections = {}
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        response = self._client.request(
+            method, uri, content=body, headers=headers,
+            follow_redirects=self.follow_redirects, timeout=self.timeout or DRIVE_HTTP_TIMEOUT
+        )
+        info = {key.lower(): value for key, value in response.headers.items()}
+        info['status'] = str(response.status_code)
+        return httplib2.Response(info), response.content
+
+    def close(self):
+        pass
+
+
 class GoogleDriveManager:
     def __init__(self, credentials_path=None):
         self.scopes = ['https://www.googleapis.com/auth/drive']
         self.credentials_path = credentials_path or os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
-        self.service = self._authenticate()
+        self._local = threading.local()
+        # (folder_id, filename) -> (file_id, cached_at)
+        self._name_cache = {}
+        # file_id -> Drive version returned by our last upload of it
+        self._versions = {}
+        self._creds = self._authenticate()
+        self._http2 = self._http2_client()
+        # Constant for the process lifetime; shown on every /start
+        self._sa_email = self._load_service_account_email()
 
     def _authenticate(self):
         try:
@@ -20,21 +73,59 @@ class GoogleDriveManager:
                 logger.warning("No credentials path provided. Drive integration will fail if not mocked.")
                 return None
             
-            creds = service_account.Credentials.from_service_account_file(
+            return service_account.Credentials.from_service_account_file(
                 self.credentials_path, scopes=self.scopes)
-            return build('drive', 'v3', credentials=creds)
         except Exception as e:
             logger.error(f"Failed to authenticate with Google Drive: {e}")
             return None
 
+    def _http2_client(self):
+        """Shared HTTP/2 client for all threads' Drive services, or None to use httplib2."""
+        if self._creds is None:
+            return None
+        try:
+            return httpx.Client(http2=True, limits=httpx.Limits(max_keepalive_connections=4))
+        except ImportError:
+            # httpx needs the h2 package for HTTP/2
+            logger.warning("h2 not installed; Drive calls use HTTP/1.1")
+            return None
+
+    @property
+    def service(self):
+        """Drive service for the calling thread.
+
+        httplib2 connections are not thread-safe, and the bot calls Drive from a pool of
+        worker threads, so each thread builds (once) and keeps its own service. With HTTP/2
+        the services share one (thread-safe) httpx client and thus its connection.
+        """
+        if self._creds is None:
+            return None
+        service = getattr(self._local, 'service', None)
+        if service is None:
+            try:
+                if self._http2 is not None:
+                    http = google_auth_httplib2.AuthorizedHttp(self._creds, http=_Http2Transport(self._http2))
+                    service = build('drive', 'v3', http=http)
+                else:
+                    service = build('drive', 'v3', credentials=self._creds)
+                self._local.service = service
+            except Exception as e:
+                logger.error(f"Failed to build Google Drive service: {e}")
+                return None
+        return service
+
     def get_service_account_email(self):
+        """Returns the client email of the service account credentials."""
+        return self._sa_email
+
+    def _load_service_account_email(self):
         """Extracts the client email from the service account credentials file."""
         try:
             if not self.credentials_path:
                 return "Unknown (No credentials path)"
             
-            with open(self.credentials_path, 'r') as f:
-                data = yaml.safe_load(f) # JSON is valid YAML
+            with open(self.credentials_path, 'rb') as f:
+                data = orjson.loads(f.read()) # Service account keys are plain JSON
                 return data.get('client_email', 'Unknown')
         except Exception as e:
             logger.error(f"Error reading credentials file: {e}")
@@ -56,36 +147,74 @@ class GoogleDriveManager:
 
     def read_yaml_file(self, file_id):
         """Reads a YAML file and parses it."""
+        content = self._download(file_id)
+        if content is None:
+            return None
+        try:
+            # The loader reads (and detects the encoding of) bytes itself; no decoded copy needed
+            return yaml.load(content, Loader=_YamlLoader)
+        except Exception as e:
+            logger.error(f"Error parsing YAML file {file_id}: {e}")
+            return None
+
+    def read_json_file(self, file_id):
+        """Reads a JSON file and parses it. An empty (freshly created) file reads as None."""
+        content = self._download(file_id)
+        # isspace() checks in place, unlike strip() which copies the whole payload
+        if not content or content.isspace():
+            return None
+        try:
+            return orjson.loads(content)
+        except Exception as e:
+            logger.error(f"Error parsing JSON file {file_id}: {e}")
+            return None
+
+    def get_file_version(self, file_id):
+        """Returns the file's Drive version number (bumped on every change), or None on error."""
         if not self.service: return None
         try:
-            request = self.service.files().get_media(fileId=file_id, supportsAllDrives=True)
-            fh = io.BytesIO()
-            downloader = MediaIoBaseDownload(fh, request)
-            done = False
-            while done is False:
-                status, done = downloader.next_chunk()
-            
-            content = fh.getvalue().decode('utf-8')
-            return yaml.safe_load(content)
+            return self.service.files().get(
+                fileId=file_id, fields='version', supportsAllDrives=True).execute().get('version')
+        except Exception as e:
+            logger.error(f"Error checking version of file {file_id}: {e}")
+            return None
+
+    def written_version(self, file_id):
+        """Returns the Drive version our last upload of `file_id` produced (no API call), or None."""
+        return self._versions.get(file_id)
 
+    def _download(self, file_id):
+        """Returns the raw bytes of a file, or None on error."""
+        if not self.service: return None
+        try:
+            # The files are small, so fetch them in one request rather than through the chunked downloader
+            return self.service.files().get_media(fileId=file_id, supportsAllDrives=True).execute()
         except Exception as e:
             logger.error(f"Error reading file {file_id}: {e}")
             return None
 
     def write_yaml_file(self, folder_id, filename, data, file_id=None):
         """Creates or updates a YAML file."""
+        content = yaml.dump(data, Dumper=_YamlDumper, default_flow_style=False).encode('utf-8')
+        return self._upload(folder_id, filename, content, 'application/x-yaml', file_id)
+
+    def write_json_file(self, folder_id, filename, data, file_id=None):
+        """Creates or updates a JSON file (for machine-only data such as the chat history)."""
+        content = orjson.dumps(data, option=orjson.OPT_APPEND_NEWLINE)
+        return self._upload(folder_id, filename, content, 'application/json', file_id)
+
+    def _upload(self, folder_id, filename, content, mimetype, file_id=None):
         if not self.service: return None
         
-        content = yaml.dump(data, default_flow_style=False)
-        
         file_metadata = {
             'name': filename,
-            'mimeType': 'application/x-yaml'
+            'mimeType': mimetype
         }
         
-        media = MediaIoBaseUpload(io.BytesIO(content.encode('utf-8')),
-                                  mimetype='application/x-yaml',
-                                  resumable=True)
+        # Resumable uploads cost an extra session-init round trip, only worth it for big files
+        media = MediaInMemoryUpload(content,
+                                    mimetype=mimetype,
+                                    resumable=len(content) >= RESUMABLE_UPLOAD_MIN_BYTES)
         
         try:
             # Upsert Logic: If file_id is missing, try to find it by name
@@ -93,20 +222,27 @@ class GoogleDriveManager:
                 file_id = self.get_file_id_by_name(folder_id, filename)
 
             if file_id:
-                # Update existing file
+                self._remember_file_id(folder_id, filename, file_id)
+                # Update existing file (the name is re-sent so a migrated file is renamed in place)
+                # Only the ID and new version are needed back, so keep the response minimal
                 file = self.service.files().update(
                     fileId=file_id,
+                    body={'name': filename},
                     media_body=media,
+                    fields='id,version',
                     supportsAllDrives=True).execute()
-                return file.get('id') or file_id
+                self._versions[file_id] = file.get('version')
+                return file_id
             else:
                 # Create new file
                 file_metadata['parents'] = [folder_id]
                 file = self.service.files().create(
                     body=file_metadata,
                     media_body=media,
-                    fields='id',
+                    fields='id,version',
                     supportsAllDrives=True).execute()
+                self._remember_file_id(folder_id, filename, file.get('id'))
+                self._versions[file.get('id')] = file.get('version')
                 return file.get('id')
         except Exception as e:
             logger.error(f"Error writing file {filename}: {e}")
@@ -117,6 +253,8 @@ class GoogleDriveManager:
         if not self.service: return False
         try:
             self.service.files().delete(fileId=file_id, supportsAllDrives=True).execute()
+            self._forget_file_id(file_id)
+            self._versions.pop(file_id, None)
             return True
         except Exception as e:
             logger.error(f"Error deleting file {file_id}: {e}")
@@ -124,8 +262,74 @@ class GoogleDriveManager:
 
     def get_file_id_by_name(self, folder_id, filename):
         """Finds a file ID by name within a folder."""
-        files = self.list_files_in_folder(folder_id)
-        for f in files:
-            if f['name'] == filename:
-                return f['id']
+        file_id = self.cached_file_id(folder_id, filename)
+        if file_id:
+            return file_id
+
+        if not self.service: return None
+        try:
+            results = self._name_query(folder_id, filename).execute()
+        except Exception as e:
+            logger.error(f"Error looking up {filename}: {e}")
+            return None
+        files = results.get('files', [])
+        if not files:
+            return None
+        self._remember_file_id(folder_id, filename, files[0]['id'])
+        return files[0]['id']
+
+    def get_file_ids_by_name(self, folder_id, filenames):
+        """Looks up several files in one batched Drive request. Returns {filename: file_id or None}.
+
+        Names whose lookup failed are left out, so callers can retry them one by one.
+        """
+        found = {name: self.cached_file_id(folder_id, name) for name in filenames}
+        missing = [name for name, file_id in found.items() if not file_id]
+        if not missing or not self.service:
+            return found
+
+        def on_result(filename, response, exception):
+            if exception is not None:
+                logger.error(f"Error looking up {filename}: {exception}")
+                found.pop(filename, None)
+                return
+            files = response.get('files', [])
+            if files:
+                found[filename] = files[0]['id']
+                self._remember_file_id(folder_id, filename, files[0]['id'])
+
+        batch = self.service.new_batch_http_request(callback=on_result)
+        for filename in missing:
+            batch.add(self._name_query(folder_id, filename), request_id=filename)
+        try:
+            batch.execute()
+        except Exception as e:
+            logger.error(f"Error looking up files in folder {folder_id}: {e}")
+            return {name: file_id for name, file_id in found.items() if file_id}
+        return found
+
+    def _name_query(self, folder_id, filename):
+        # Filter on the Drive side and fetch only the ID instead of listing the whole folder
+        escaped = filename.replace('\\', '\\\\').replace("'", "\\'")
+        return self.service.files().list(
+            q=f"name = '{escaped}' and '{folder_id}' in parents and trashed = false",
+            fields="files(id)",
+            pageSize=1,
+            supportsAllDrives=True,
+            includeItemsFromAllDrives=True)
+
+    def cached_file_id(self, folder_id, filename):
+        """Returns a recently seen file ID without calling Drive, or None."""
+        cached = self._name_cache.get((folder_id, filename))
+        if cached and time.monotonic() - cached[1] < NAME_CACHE_TTL_SECONDS:
+            return cached[0]
         return None
+
+    def _remember_file_id(self, folder_id, filename, file_id):
+        if file_id:
+            self._name_cache[(folder_id, filename)] = (file_id, time.monotonic())
+
+    def _forget_file_id(self, file_id):
+        for key, (cached_id, _) in list(self._name_cache.items()):
+            if cached_id == file_id:
+                self._name_cache.pop(key, None)
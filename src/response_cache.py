@@ -0,0 +1,122 @@
+import os
+import math
+import time
+import sqlite3
+import hashlib
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Scripture text never changes, so cached passages can live for a long time
+SCRIPTURE_TTL_SECONDS = 30 * 24 * 3600
+
+# Discussion answers are reused only for near-duplicate questions
+SEMANTIC_MIN_SIMILARITY = 0.92
+# Remembered (question, answer) pairs per user
+SEMANTIC_MAX_ENTRIES = 50
+
+
+class ScriptureCache:
+    """Exact-match SQLite cache of passage text keyed by (reference, translation)."""
+
+    def __init__(self, path=None, ttl_seconds=SCRIPTURE_TTL_SECONDS):
+        self.path = path or os.environ.get(
+            'SCRIPTURE_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'bible_bot_scripture.sqlite3')
+        )
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        try:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS scripture (key TEXT PRIMARY KEY, text TEXT NOT NULL, stored_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Scripture cache disabled, could not open {self.path}: {e}")
+            self._conn = None
+
+    @staticmethod
+    def key(reference, translation):
+        normalized = f"{' '.join(reference.split()).lower()}|{translation.strip().upper()}"
+        return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+    def get(self, reference, translation):
+        """Returns the cached passage text, or None on a miss or expired entry."""
+        if self._conn is None:
+            return None
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT text, stored_at FROM scripture WHERE key = ?", (self.key(reference, translation),)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Scripture cache read error: {e}")
+            return None
+        if not row or time.time() - row[1] > self.ttl_seconds:
+            return None
+        return row[0]
+
+    def set(self, reference, translation, text):
+        if self._conn is None:
+            return
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO scripture (key, text, stored_at) VALUES (?, ?, ?)",
+                    (self.key(reference, translation), text, time.time())
+                )
+                self._conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Scripture cache write error: {e}")
+
+
+class SemanticCache:
+    """Per-user store of (question embedding, answer) pairs for the reading being discussed.
+
+    Each pair also records the conversation it was asked in (`context_key`, e.g. a hash of the
+    previous reply), so follow-ups such as "why?" only match answers given in the same context.
+    Indexes are small (SEMANTIC_MAX_ENTRIES), so a linear cosine scan is enough.
+    """
+
+    def __init__(self, min_similarity=SEMANTIC_MIN_SIMILARITY, max_entries=SEMANTIC_MAX_ENTRIES):
+        self.min_similarity = min_similarity
+        self.max_entries = max_entries
+        # user key -> (reading key, [(unit vector, context key, answer)])
+        self._indexes = {}
+
+    @staticmethod
+    def _normalize(vector):
+        norm = math.sqrt(sum(x * x for x in vector))
+        return [x / norm for x in vector] if norm else None
+
+    def lookup(self, user_key, reading_key, vector, context_key=None):
+        """Returns the stored answer most similar to `vector`, if it clears min_similarity."""
+        index = self._indexes.get(user_key)
+        query = self._normalize(vector)
+        if not index or index[0] != reading_key or query is None:
+            return None
+
+        best_score, best_answer = 0.0, None
+        for stored, stored_context, answer in index[1]:
+            if stored_context != context_key:
+                continue
+            score = sum(a * b for a, b in zip(stored, query))
+            if score > best_score:
+                best_score, best_answer = score, answer
+        return best_answer if best_score >= self.min_similarity else None
+
+    def store(self, user_key, reading_key, vector, answer, context_key=None):
+        unit = self._normalize(vector)
+        if unit is None:
+            return
+        index = self._indexes.get(user_key)
+        # Answers are only meaningful for the reading they were given about
+        if not index or index[0] != reading_key:
+            index = self._indexes[user_key] = (reading_key, [])
+        index[1].append((unit, context_key, answer))
+        del index[1][:-self.max_entries]
+
+    def clear(self, user_key):
+        self._indexes.pop(user_key, None)
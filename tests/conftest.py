@@ -0,0 +1,113 @@
+import asyncio
+from dataclasses import dataclass, field
+from unittest.mock import MagicMock, AsyncMock, patch
+
+import pytest
+
+from src.bot import BibleBot
+from src.ai_agent import GeminiAgent
+
+
+# The mocks are built once per session and reset between tests; building the
+# attribute graph again for every test is most of the fixture cost.
+@pytest.fixture(scope="session")
+def _drive_template():
+    return MagicMock()
+
+@pytest.fixture(scope="session")
+def _ai_template():
+    # spec makes the agent's async methods AsyncMocks
+    return MagicMock(spec=GeminiAgent)
+
+@pytest.fixture
+def drive(_drive_template):
+    _drive_template.reset_mock(return_value=True, side_effect=True)
+    _drive_template.cached_file_id.return_value = None
+    _drive_template.get_file_version.return_value = None
+    _drive_template.written_version.return_value = None
+    return _drive_template
+
+@pytest.fixture
+def ai(_ai_template):
+    _ai_template.reset_mock(return_value=True, side_effect=True)
+    _ai_template.supports_plan_batches = False
+    return _ai_template
+
+@pytest.fixture(scope="session")
+def _bot_template():
+    # Building the Application and registering handlers is the same for every test
+    return BibleBot("dummy_token", MagicMock(), MagicMock())
+
+@pytest.fixture
+def bot(_bot_template, drive, ai):
+    bot = _bot_template
+    bot.drive = drive
+    bot.ai = ai
+    yield bot
+    # The loop outlives the test, so delayed flushes must not fire in a later one
+    for task in bot._pending_flushes.values():
+        task.cancel()
+    bot._pending_flushes.clear()
+    for task in bot._background_tasks:
+        task.cancel()
+    bot._background_tasks.clear()
+    bot._drive_cache.clear()
+    bot._file_locks.clear()
+    bot._batch_submissions.clear()
+
+class _Message:
+    """The parts of telegram.Message the handlers touch."""
+
+    def __init__(self):
+        self.text = ""
+        self.reply_text = AsyncMock()
+
+class _User:
+    def __init__(self, user_id=1):
+        self.id = user_id
+
+class _CallbackQuery:
+    def __init__(self):
+        self.data = ""
+        self.answer = AsyncMock()
+        self.edit_message_reply_markup = AsyncMock()
+
+class _Update:
+    """Plain stand-in for telegram.Update; AsyncMock builds a mock for every attribute probed."""
+
+    def __init__(self):
+        self.message = _Message()
+        self.effective_user = _User()
+        self.callback_query = _CallbackQuery()
+
+    @property
+    def effective_message(self):
+        return self.message
+
+@pytest.fixture
+def update():
+    return _Update()
+
+class _Bot:
+    def __init__(self):
+        self.edit_message_text = AsyncMock()
+        self.send_message = AsyncMock()
+
+@dataclass
+class _Ctx:
+    """Stand-in for the handler context: a real user_data dict and the bot calls used for streaming."""
+    user_data: dict = field(default_factory=dict)
+    bot: _Bot = field(default_factory=_Bot)
+
+@pytest.fixture
+def context():
+    return _Ctx()
+
+async def _inline_run_in_executor(self, executor, func, *args):
+    return func(*args)
+
+@pytest.fixture(autouse=True, scope="session")
+def _patch_executor():
+    """Runs executor jobs inline so Drive calls happen synchronously."""
+    with patch.object(asyncio.BaseEventLoop, "run_in_executor", new=_inline_run_in_executor):
+        yield
@@ -0,0 +1,202 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from google import genai
+from google.genai import types
+
+from src.ai_agent import (
+    GeminiAgent, UNAVAILABLE_MESSAGE, DEFAULT_MAX_TOKENS, BIBLE_TEXT_MAX_TOKENS, TOKENS_PER_CHAPTER, TOKENS_PER_VERSE,
+)
+
+# Saved before conftest swaps in the inline executor, for tests that need real threads
+_REAL_RUN_IN_EXECUTOR = asyncio.BaseEventLoop.run_in_executor
+
+
+class _FakeChat:
+    def __init__(self, client, config, history):
+        self._client = client
+        self.config = config
+        self.history = history
+
+    def send_message(self, message, config=None):
+        self._client.sent.append((message, config or self.config))
+        self._client.threads.append(threading.current_thread().name)
+        return self._client.response
+
+    def send_message_stream(self, message, config=None):
+        self._client.sent.append((message, config or self.config))
+        for text in self._client.chunks:
+            # Stands in for the blocking read of the next HTTP chunk
+            time.sleep(self._client.chunk_delay)
+            yield SimpleNamespace(text=text)
+
+class _FakeClient:
+    """The slice of genai.Client the agent calls, answering from canned responses."""
+
+    def __init__(self):
+        self.sent = []
+        self.threads = []
+        self.chunks = ["a", "b", "c"]
+        self.chunk_delay = 0
+        self.response = SimpleNamespace(text="reply", candidates=None)
+        self.chats = SimpleNamespace(create=self._create_chat)
+        self.vertexai = False
+        self.deleted = []
+        self.files = SimpleNamespace(
+            upload=lambda file, config: SimpleNamespace(name="files/plan"), delete=self._delete_file
+        )
+        self.batches = SimpleNamespace(create=self._create_batch)
+        self.embed_delay = 0
+        self.models = SimpleNamespace(embed_content=self._embed)
+
+    def _embed(self, model, contents, config=None):
+        time.sleep(self.embed_delay)
+        return SimpleNamespace(embeddings=[SimpleNamespace(values=[1.0, 0.0])])
+
+    def _create_batch(self, model, src):
+        raise ValueError("This method is only supported in the Vertex AI client.")
+
+    def _delete_file(self, name):
+        self.deleted.append(name)
+
+    def _create_chat(self, model, config=None, history=None):
+        return _FakeChat(self, config, history)
+
+@pytest.fixture
+def agent(tmp_path, monkeypatch):
+    monkeypatch.setenv('SCRIPTURE_CACHE_PATH', str(tmp_path / 'scripture.sqlite3'))
+    agent = GeminiAgent(api_key="test-key")
+    agent.client = _FakeClient()
+    yield agent
+    agent.shutdown()
+
+@pytest.fixture
+def real_executor(monkeypatch):
+    monkeypatch.setattr(asyncio.BaseEventLoop, "run_in_executor", _REAL_RUN_IN_EXECUTOR)
+
+async def test_stream_does_not_block_event_loop(agent, real_executor):
+    """Test a slow Gemini stream leaves the event loop free for other users' updates."""
+    agent.client.chunk_delay = 0.05
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    task = asyncio.create_task(ticker())
+    chunks = [chunk async for chunk in agent._astream_response("Hi")]
+    task.cancel()
+
+    assert chunks == ["a", "b", "c"]
+    assert ticks >= 5
+
+async def test_calls_run_on_gemini_pool(agent, real_executor):
+    """Test Gemini calls use the agent's own threads, not the loop's default (Drive) executor."""
+    assert await agent.agenerate_response("Hi") == "reply"
+    assert agent.client.threads[0].startswith('gemini')
+
+async def test_discussion_stream_without_client(agent):
+    """Test the discussion stream reports the assistant as unavailable when there is no Gemini client."""
+    agent.client = None
+    chunks = [chunk async for chunk in agent.adiscuss_reading_stream("Hi", [], "Genesis 1")]
+    assert chunks == [UNAVAILABLE_MESSAGE]
+
+async def test_cached_session_sends_current_config(agent):
+    """Test a reused chat session sends this turn's config, not the one it was created with."""
+    cached = types.GenerateContentConfig(cached_content="cachedContents/1")
+    expired = types.GenerateContentConfig(system_instruction="persona and reading")
+
+    await agent.agenerate_response("Hi", config=cached, session_key=1)
+    await agent.agenerate_response("And then?", config=expired, session_key=1)
+
+    (_, first), (_, second) = agent.client.sent
+    assert first.cached_content == "cachedContents/1"
+    assert second.cached_content is None
+    assert second.system_instruction == "persona and reading"
+
+@pytest.mark.parametrize("finish_reason, cached", [
+    (types.FinishReason.STOP, True),
+    (types.FinishReason.MAX_TOKENS, False),
+], ids=["complete", "truncated"])
+async def test_bible_text_cached_only_when_complete(agent, finish_reason, cached):
+    """Test a passage cut off at the output cap is returned but not kept in the scripture cache."""
+    agent.client.response = SimpleNamespace(
+        text="In the beginning...", candidates=[SimpleNamespace(finish_reason=finish_reason)]
+    )
+
+    assert await agent.aget_bible_text("Genesis 1") == "In the beginning..."
+    assert (agent.scripture_cache.get("Genesis 1", "ESV") is not None) == cached
+
+@pytest.mark.parametrize("reference, expected", [
+    ("Romans 8:28-39", 12 * TOKENS_PER_VERSE),
+    ("John 3:16", DEFAULT_MAX_TOKENS),
+    ("Psalm 23", TOKENS_PER_CHAPTER),
+    ("Genesis 1-2", 2 * TOKENS_PER_CHAPTER),
+    ("Genesis 1:1-2:3", TOKENS_PER_CHAPTER + 3 * TOKENS_PER_VERSE),
+    ("Genesis 1; Matthew 1", 2 * TOKENS_PER_CHAPTER),
+    ("John 3:16, 18-20; Romans 8:28", DEFAULT_MAX_TOKENS),
+    ("Psalm 119:1-20, 150-176", 47 * TOKENS_PER_VERSE),
+    ("Genesis 1-10", BIBLE_TEXT_MAX_TOKENS),
+], ids=["verses", "one_verse", "chapter", "chapters", "cross_chapter", "multiple_books", "verse_list",
+        "verse_ranges", "capped"])
+def test_bible_text_max_tokens(agent, reference, expected):
+    """Test the scripture output cap covers every part of a reference."""
+    assert agent._bible_text_max_tokens(reference) == expected
+
+@pytest.mark.parametrize("version, supported", [("1.2.0", False), ("1.24.0", True)])
+def test_plan_batches_need_sdk_support(agent, monkeypatch, version, supported):
+    """Test plan batches are only offered where the SDK can create them on the Gemini API."""
+    monkeypatch.setattr(genai, "__version__", version)
+    assert agent.supports_plan_batches == supported
+
+async def test_failed_plan_batch_removes_upload(agent, monkeypatch):
+    """Test the uploaded plan slices are deleted when the batch job can't be created."""
+    monkeypatch.setattr(genai, "__version__", "1.24.0")
+
+    assert await agent.asubmit_plan_batch({'translation': 'ESV'}, [8, 15, 22]) is None
+    assert agent.client.deleted == ["files/plan"]
+
+async def _discuss(agent, user_input, history):
+    return [chunk async for chunk in agent.adiscuss_reading_stream(user_input, history, "Genesis 1", session_key=1)]
+
+async def test_follow_up_is_not_served_an_answer_from_another_context(agent):
+    """Test the same follow-up after a different reply gets a fresh answer, not the cached one."""
+    first = [{'role': 'user', 'parts': ["Who built the ark?"]}, {'role': 'model', 'parts': ["Noah."]}]
+    second = [{'role': 'user', 'parts': ["Who left Ur?"]}, {'role': 'model', 'parts': ["Abram."]}]
+
+    assert await _discuss(agent, "why?", first) == ["a", "b", "c"]
+    agent.client.chunks = ["d"]
+    assert await _discuss(agent, "why?", second) == ["d"]
+    # Asked again after the same reply, the answer is reused
+    assert await _discuss(agent, "why?", first) == ["abc"]
+    assert len(agent.client.sent) == 2
+
+async def test_cached_answer_resets_chat_session(agent):
+    """Test a cache hit drops the live chat session, which never saw the served turn."""
+    await _discuss(agent, "What is this about?", [])
+    assert 1 in agent._chat_sessions
+
+    assert await _discuss(agent, "What is this about?", []) == ["abc"]
+    assert 1 not in agent._chat_sessions
+
+async def test_slow_embedding_does_not_delay_reply(agent, real_executor, monkeypatch):
+    """Test the reply streams without the semantic cache when the embedding is slow."""
+    monkeypatch.setattr('src.ai_agent.SEMANTIC_EMBED_TIMEOUT', 0.01)
+    agent.client.embed_delay = 0.2
+
+    started = time.monotonic()
+    assert await _discuss(agent, "Hi", []) == ["a", "b", "c"]
+    assert time.monotonic() - started < 0.2
+
+async def test_expired_cache_names_are_forgotten(agent, monkeypatch):
+    """Test expired context caches don't pile up for users who never look them up again."""
+    agent._cache_expiry = {"cachedContents/old": time.monotonic() - 1, "cachedContents/live": time.monotonic() + 60}
+
+    agent.evict_stale_sessions()
+
+    assert list(agent._cache_expiry) == ["cachedContents/live"]
@@ -1,197 +1,593 @@
-import unittest
-from unittest.mock import MagicMock, AsyncMock, patch, ANY
-import sys
-import os
+from unittest.mock import ANY
 import asyncio
+import copy
+from datetime import datetime, timezone
 
-# Ensure src can be imported
-sys.path.append(os.path.join(os.path.dirname(__file__), '../src'))
-
-from src.bot import BibleBot, DRIVE_SETUP, ONBOARDING_LANGUAGE, IDLE, READING, DISCUSSION
-
-class TestBibleBotLogic(unittest.IsolatedAsyncioTestCase):
-    def setUp(self):
-        self.mock_drive = MagicMock()
-        self.mock_ai = MagicMock()
-        self.bot = BibleBot("dummy_token", self.mock_drive, self.mock_ai)
-        
-        # Mock Context and Update
-        self.mock_update = AsyncMock()
-        self.mock_context = MagicMock()
-        self.mock_context.user_data = {}
-        
-        # Mock the event loop executor
-        self.mock_loop = MagicMock()
-        self.loop_patcher = patch('asyncio.get_running_loop', return_value=self.mock_loop)
-        self.loop_patcher.start()
-        
-        async def async_executor(executor, func, *args):
-            if callable(func):
-                return func(*args)
-            return func
-            
-        self.mock_loop.run_in_executor.side_effect = async_executor
-
-    def tearDown(self):
-        self.loop_patcher.stop()
-
-    async def test_start_command(self):
-        """Test the /start command triggers DRIVE_SETUP state."""
-        state = await self.bot.start(self.mock_update, self.mock_context)
-        self.assertEqual(state, DRIVE_SETUP)
-        self.mock_update.message.reply_text.assert_called_once()
-        # Verify message mentions manual file creation with .yaml extension
-        args = self.mock_update.message.reply_text.call_args[0][0]
-        self.assertIn("profile.yaml", args)
-        self.assertIn("reading_plan.yaml", args)
-
-    async def test_drive_setup_success_new_user_write_ok(self):
-        """Test valid folder, no profile, write access OK -> ONBOARDING."""
-        self.mock_update.message.text = "valid_folder_id"
-        self.mock_drive.list_files_in_folder.return_value = [{'id': '1', 'name': 'test'}]
-        # Mock no existing profile
-        self.mock_drive.get_file_id_by_name.return_value = None
-        # Mock successful write test
-        self.mock_drive.write_yaml_file.return_value = "test_file_id"
-        
-        state = await self.bot.drive_setup_handler(self.mock_update, self.mock_context)
-        
-        self.assertEqual(state, ONBOARDING_LANGUAGE)
-        self.assertEqual(self.mock_context.user_data['drive_folder_id'], "valid_folder_id")
-        self.mock_drive.delete_file.assert_called_with("test_file_id")
-        # Check for intro text
-        args = self.mock_update.message.reply_text.call_args[0][0]
-        self.assertIn("Bible Reading Companion", args)
-
-    async def test_drive_setup_quota_error(self):
-        """Test valid folder, no profile, write access fails (Quota) -> Ask User."""
-        self.mock_update.message.text = "valid_folder_id"
-        self.mock_drive.list_files_in_folder.return_value = [{'id': '1', 'name': 'test'}]
-        self.mock_drive.get_file_id_by_name.return_value = None
-
-        # Mock write failure with Quota message
-        self.mock_drive.write_yaml_file.side_effect = Exception("Service Accounts do not have storage quota")
-
-        state = await self.bot.drive_setup_handler(self.mock_update, self.mock_context)
-
-        self.assertEqual(state, DRIVE_SETUP)
-        # Verify instructions mention .yaml
-        args = self.mock_update.message.reply_text.call_args[0][0]
-        self.assertIn("manually create these **empty files**", args)
-        # In the actual code (bot.py), the message lists "1. `profile.yaml`"
-        self.assertIn("`profile.yaml`", args)
-
-    async def test_drive_setup_existing_profile_full(self):
-        """Test valid folder, profile exists and has data -> IDLE (Welcome Back)."""
-        self.mock_update.message.text = "valid_folder_id"
-        self.mock_drive.list_files_in_folder.return_value = [{'id': '1', 'name': 'test'}]
-        # Mock existing profile
-        self.mock_drive.get_file_id_by_name.return_value = "existing_profile_id"
-        # Mock reading profile with data
-        self.mock_drive.read_yaml_file.return_value = {'language': 'en'}
-        
-        state = await self.bot.drive_setup_handler(self.mock_update, self.mock_context)
-        
-        self.assertEqual(state, IDLE)
-        self.assertIn("Welcome back", self.mock_update.message.reply_text.call_args[0][0])
-
-    async def test_drive_setup_existing_profile_empty(self):
-        """Test valid folder, profile exists but empty -> ONBOARDING."""
-        self.mock_update.message.text = "valid_folder_id"
-        self.mock_drive.list_files_in_folder.return_value = [{'id': '1', 'name': 'test'}]
-        self.mock_drive.get_file_id_by_name.return_value = "existing_profile_id"
-        # Mock reading empty profile
-        self.mock_drive.read_yaml_file.return_value = {}
-
-        state = await self.bot.drive_setup_handler(self.mock_update, self.mock_context)
-
-        self.assertEqual(state, ONBOARDING_LANGUAGE)
-        args = self.mock_update.message.reply_text.call_args[0][0]
-        self.assertIn("empty profile.yaml", args)
-        self.assertIn("Bible Reading Companion", args)
-
-    async def test_onboarding_flow(self):
-        """Test the sequence of onboarding questions."""
-        self.mock_context.user_data['drive_folder_id'] = "fid"
-        
-        # Skip to saving
-        self.mock_context.user_data.update({
-            'language': 'En', 'translation': 'ESV', 'denomination': 'None',
-            'style': 'Casual', 'pacing': 'Fast'
-        })
-        self.mock_update.message.text = "Canonical" # Ordering
-        
-        self.mock_ai.generate_reading_plan.return_value = "Day 1: Genesis 1"
-        
-        state = await self.bot.onboarding_ordering(self.mock_update, self.mock_context)
-        
-        self.assertEqual(state, IDLE)
-        # Check if profile was saved
-        self.mock_drive.write_yaml_file.assert_any_call("fid", 'profile.yaml', ANY)
-        # Check if plan was saved with correct structure
-        self.mock_drive.write_yaml_file.assert_any_call("fid", 'reading_plan.yaml', {'generated_at': 'now', 'plan': "Day 1: Genesis 1"})
-
-    async def test_read_command_success(self):
-        """Test /read command fetches text and transitions to READING."""
-        self.mock_context.user_data['drive_folder_id'] = "fid"
-        
-        self.mock_drive.get_file_id_by_name.side_effect = ["p_id", "plan_id"]
-        # Mock reading files with YAML structure
-        self.mock_drive.read_yaml_file.side_effect = [
-            {'current_day': 1, 'translation': 'ESV'}, # Profile
-            {'plan': "Day 1: Gen 1"} # Plan
-        ]
-        
-        self.mock_ai.generate_response.return_value = "Genesis 1"
-        self.mock_ai.get_bible_text.return_value = "In the beginning..."
-        
-        state = await self.bot.read_command(self.mock_update, self.mock_context)
-        
-        self.assertEqual(state, READING)
-
-    async def test_done_command(self):
-        """Test /done updates progress and transitions to DISCUSSION."""
-        self.mock_context.user_data['drive_folder_id'] = "fid"
-        self.mock_drive.get_file_id_by_name.return_value = "p_id"
-        self.mock_drive.read_yaml_file.return_value = {'current_day': 1}
-        
-        state = await self.bot.done_command(self.mock_update, self.mock_context)
-        
-        self.assertEqual(state, DISCUSSION)
-        self.mock_drive.write_yaml_file.assert_called()
-
-    async def test_discussion_flow(self):
-        """Test discussion handler uses AI and saves history."""
-        self.mock_context.user_data['drive_folder_id'] = "fid"
-        self.mock_context.user_data['profile'] = {'denomination': 'Baptist'}
-        self.mock_context.user_data['chat_history'] = []
-        
-        self.mock_update.message.text = "What does this mean?"
-        self.mock_ai.discuss_reading.return_value = "It means..."
-        
-        self.mock_drive.get_file_id_by_name.return_value = None
-        
-        state = await self.bot.discussion_handler(self.mock_update, self.mock_context)
-        
-        self.assertEqual(state, DISCUSSION)
-        self.mock_drive.write_yaml_file.assert_called_with(
-            "fid", 'chat_history.yaml', ANY, file_id=None
+import pytest
+from telegram import Chat, Message, Update, User
+from telegram.error import RetryAfter, TimedOut
+from telegram.ext import ConversationHandler
+
+from src.bot import _PerUserUpdateProcessor, _plan_index, _last_planned_day, _normalize_plan, _ONBOARD_STEPS, DRIVE_SETUP, ONBOARDING, IDLE, READING, DISCUSSION, CHAT_FLUSH_TURNS
+
+
+async def _astream(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+# Canonical Drive payloads. Handlers update what they read in place, so tests
+# only ever hand out copies of these.
+PROFILE_DAY1 = {'current_day': 1, 'translation': 'ESV'}
+PLAN_DAY1 = {'plan': "Day 1: Gen 1"}
+PLAN_DAY2 = {'plan': "Day 1: Gen 1\nDay 2: Gen 2"}
+
+_FILE_IDS = {'profile.yaml': "p_id", 'reading_plan.yaml': "plan_id", 'chat_history.yaml': "old_id"}
+
+def _serve_files(drive, files):
+    """Serves `files` (filename -> parsed body) from the Drive mock by name, in any call order."""
+    bodies = {_FILE_IDS[name]: body for name, body in files.items()}
+    drive.get_file_id_by_name.side_effect = lambda folder_id, name: _FILE_IDS[name] if name in files else None
+    drive.read_yaml_file.side_effect = lambda file_id: copy.deepcopy(bodies.get(file_id))
+
+def _find_call(mock, filename):
+    """Returns the first call of a Drive write mock for `filename`."""
+    return next(c for c in mock.call_args_list if c.args[1] == filename)
+
+async def test_start_command(bot, update, context):
+    """Test the /start command triggers DRIVE_SETUP state."""
+    state = await bot.start(update, context)
+    assert state == DRIVE_SETUP
+    update.message.reply_text.assert_called_once()
+    # Verify message mentions manual file creation with .yaml extension
+    args = update.message.reply_text.call_args[0][0]
+    assert "profile.yaml" in args
+    assert "reading_plan.yaml" in args
+
+@pytest.mark.parametrize("profile_id,profile_data,write_result,expected_state,expected_texts", [
+    # No profile, write access OK -> ONBOARDING, test file cleaned up
+    (None, None, "test_file_id", ONBOARDING, ["Bible Reading Companion"]),
+    # No profile, write fails with the Service Account quota error -> ask for placeholder files
+    (None, None, Exception("Service Accounts do not have storage quota"), DRIVE_SETUP,
+     ["manually create these **empty files**", "`profile.yaml`"]),
+    # Profile exists and has data -> IDLE (Welcome Back)
+    ("existing_profile_id", {'language': 'en'}, None, IDLE, ["Welcome back"]),
+    # Profile exists but is an empty placeholder -> ONBOARDING
+    ("existing_profile_id", {}, None, ONBOARDING, ["empty profile.yaml", "Bible Reading Companion"]),
+])
+async def test_drive_setup(bot, drive, update, context, profile_id, profile_data, write_result,
+                           expected_state, expected_texts):
+    """Test folder verification routes to onboarding, returning user or placeholder instructions."""
+    update.message.text = "valid_folder_id"
+    drive.list_files_in_folder.return_value = [{'id': '1', 'name': 'test'}]
+    drive.get_file_id_by_name.return_value = profile_id
+    drive.read_yaml_file.return_value = profile_data
+    if isinstance(write_result, Exception):
+        drive.write_yaml_file.side_effect = write_result
+    else:
+        drive.write_yaml_file.return_value = write_result
+
+    state = await bot.drive_setup_handler(update, context)
+
+    assert state == expected_state
+    assert context.user_data['drive_folder_id'] == "valid_folder_id"
+    if write_result and not isinstance(write_result, Exception):
+        drive.delete_file.assert_called_with(write_result)
+    else:
+        drive.delete_file.assert_not_called()
+    args = update.message.reply_text.call_args[0][0]
+    for text in expected_texts:
+        assert text in args
+
+async def test_drive_setup_clears_stale_onboarding(bot, drive, update, context):
+    """Test answers left over from an abandoned onboarding don't let one /quickstart press finish it."""
+    context.user_data.update({field: "stale" for field, _ in _ONBOARD_STEPS})
+    update.message.text = "valid_folder_id"
+    drive.get_file_id_by_name.return_value = None
+    drive.write_yaml_file.return_value = "test_file_id"
+
+    assert await bot.drive_setup_handler(update, context) == ONBOARDING
+    assert not any(field in context.user_data for field, _ in _ONBOARD_STEPS)
+
+    update.callback_query.data = "qs:translation:NIV"
+    assert await bot.quickstart_choice(update, context) == ONBOARDING
+
+@pytest.mark.parametrize("data", ["qs:drive_folder_id:other", "qs:translation:MSG", "qs:translation"],
+                         ids=["unknown_field", "unknown_value", "malformed"])
+async def test_quickstart_ignores_unknown_choices(bot, update, context, data):
+    """Test callback data outside the offered presets never reaches user_data."""
+    context.user_data['drive_folder_id'] = "fid"
+    update.callback_query.data = data
+
+    assert await bot.quickstart_choice(update, context) == ONBOARDING
+    assert context.user_data == {'drive_folder_id': "fid"}
+
+_ONBOARD_ANSWERS = ['En', 'ESV', 'None', 'Casual', 'Fast', 'Canonical']
+
+@pytest.mark.parametrize("idx,answer", list(enumerate(_ONBOARD_ANSWERS[:-1])))
+async def test_onboarding_step_asks_next_question(bot, update, context, idx, answer):
+    """Test every answer but the last is stored and followed by the next question."""
+    context.user_data['_onboard_idx'] = idx
+    update.message.text = answer
+
+    state = await bot.onboarding_step(update, context)
+
+    assert state == ONBOARDING
+    assert context.user_data[_ONBOARD_STEPS[idx][0]] == answer
+    assert context.user_data['_onboard_idx'] == idx + 1
+    update.message.reply_text.assert_called_once_with(_ONBOARD_STEPS[idx + 1][1])
+
+async def test_onboarding_last_answer_saves_profile(bot, drive, ai, update, context):
+    """Test the final onboarding answer saves the profile and the first plan."""
+    context.user_data['drive_folder_id'] = "fid"
+    context.user_data.update({field: answer for (field, _), answer in zip(_ONBOARD_STEPS, _ONBOARD_ANSWERS)})
+    context.user_data['_onboard_idx'] = len(_ONBOARD_STEPS) - 1
+    ai.agenerate_reading_plan.return_value = "Day 1: Genesis 1"
+
+    update.message.text = "Canonical" # Ordering
+    state = await bot.onboarding_step(update, context)
+
+    assert state == IDLE
+    # Check if profile was saved
+    profile_call = _find_call(drive.write_yaml_file, 'profile.yaml')
+    assert profile_call.args[0] == "fid"
+    assert profile_call.args[2]['ordering'] == "Canonical"
+    # Check if plan was saved with correct structure
+    plan_call = _find_call(drive.write_yaml_file, 'reading_plan.yaml')
+    assert plan_call.args == ("fid", 'reading_plan.yaml', {'generated_at': 'now', 'plan': "Day 1: Genesis 1"})
+
+async def test_quickstart_finishes_onboarding(bot, drive, ai, update, context):
+    """Test /quickstart button presses fill the profile and finish onboarding once all are chosen."""
+    context.user_data['drive_folder_id'] = "fid"
+    ai.agenerate_reading_plan.return_value = "Day 1: Genesis 1"
+
+    choices = ["language:English", "translation:NIV", "denomination:General",
+               "style:Devotional", "pacing:1 chapter/day", "ordering:Chronological"]
+    for choice in choices:
+        update.callback_query.data = f"qs:{choice}"
+        state = await bot.quickstart_choice(update, context)
+
+    assert state == IDLE
+    assert _find_call(drive.write_yaml_file, 'profile.yaml').args == ("fid", 'profile.yaml', {
+        'language': 'English', 'translation': 'NIV', 'denomination': 'General',
+        'style': 'Devotional', 'pacing': '1 chapter/day', 'ordering': 'Chronological',
+        'current_day': 1
+    })
+    ai.agenerate_reading_plan.assert_called_once()
+
+@pytest.mark.parametrize("profile,plan,generated,batch,expected_ref,expected_plan", [
+    # Today's reference is parsed from the plan without an extra Gemini call
+    (PROFILE_DAY1, PLAN_DAY1, None, None, "Gen 1", None),
+    # Past the end of the plan: the next part is generated first
+    ({'current_day': 3, 'translation': 'ESV'}, {'plan': "Day 1: Gen 1\nDay 2: Gen 2 (see Day 3 notes)"},
+     "Day 3: Gen 3\nDay 4: Gen 4", None, "Gen 3", None),
+    # A finished background plan batch is appended instead of generating synchronously
+    ({'current_day': 2, 'translation': 'ESV'}, {'plan': "Day 1: Gen 1", 'pending_batch': "batches/123"},
+     None, {2: "Day 2: Gen 2"}, "Gen 2", {'plan': "Day 1: Gen 1\n\nDay 2: Gen 2"}),
+    # Plans written before normalization keep their Markdown and ranges
+    ({'current_day': 2, 'translation': 'ESV'}, {'plan': "- **Day 1:** Gen 1\n- **Day 2:** Gen 2"},
+     None, None, "Gen 2", None),
+    ({'current_day': 4, 'translation': 'ESV'}, {'plan': "Day 1-2: Gen 1-4\nDay 3-4: Gen 5"},
+     None, None, "Gen 5", None),
+], ids=["planned_day", "extends_ended_plan", "merges_finished_batch", "bold_plan", "day_range_plan"])
+async def test_read_command(bot, drive, ai, update, context, profile, plan, generated, batch,
+                            expected_ref, expected_plan):
+    """Test /read finds today's reference, fetches its text and transitions to READING."""
+    context.user_data['drive_folder_id'] = "fid"
+    _serve_files(drive, {'profile.yaml': profile, 'reading_plan.yaml': plan})
+    drive.write_yaml_file.return_value = "plan_id"
+    ai.agenerate_response.return_value = generated
+    ai.apoll_plan_batch.return_value = batch
+    ai.aget_bible_text.return_value = "In the beginning..."
+
+    state = await bot.read_command(update, context)
+
+    assert state == READING
+    assert ai.agenerate_response.call_count == (1 if generated else 0)
+    if batch:
+        ai.apoll_plan_batch.assert_called_once_with(plan['pending_batch'])
+    ai.aget_bible_text.assert_called_once_with(expected_ref, translation='ESV')
+    if expected_plan:
+        drive.write_yaml_file.assert_called_once_with(
+            "fid", 'reading_plan.yaml', expected_plan, file_id="plan_id"
         )
 
-    async def test_help_command(self):
-        """Test /help command sends the help message."""
-        await self.bot.help_command(self.mock_update, self.mock_context)
+@pytest.mark.parametrize("supported", [True, False], ids=["supported", "unsupported"])
+async def test_plan_batch_needs_sdk_support(bot, ai, supported):
+    """Test the next weeks of a plan are only queued when the Batch API can take them."""
+    ai.supports_plan_batches = supported
+    ai.asubmit_plan_batch.return_value = None
+
+    bot._prefetch_plan("fid", PROFILE_DAY1, dict(PLAN_DAY1), 1)
+    await asyncio.sleep(0)
+
+    assert ai.asubmit_plan_batch.called == supported
+
+async def test_plan_batch_starts_after_last_entry(bot, ai):
+    """Test a "see Day N" mention inside an entry doesn't move where the next batch starts."""
+    ai.supports_plan_batches = True
+    ai.asubmit_plan_batch.return_value = None
+
+    bot._prefetch_plan("fid", PROFILE_DAY1, {'plan': "Day 1: Gen 1 (see Day 30 notes)"}, 1)
+    await asyncio.sleep(0)
+
+    ai.asubmit_plan_batch.assert_called_once_with(PROFILE_DAY1, [2, 9, 16])
+
+@pytest.mark.parametrize("plan, expected", [
+    ("- **Day 1:** Genesis 1\n- **Day 2:** Genesis 2", {1: "Genesis 1", 2: "Genesis 2"}),
+    ("1. __Day 3__: Exodus 1", {3: "Exodus 1"}),
+    ("Day 3-4: Genesis 5", {3: "Genesis 5", 4: "Genesis 5"}),
+    ("Day 3 - 1 Samuel 3", {3: "1 Samuel 3"}),
+    ("Day 1: Gen 1 (see Day 30 notes)\nRead Day 2 slowly", {1: "Gen 1 (see Day 30 notes)"}),
+], ids=["bold", "numbered", "range", "dash_separator", "mentions"])
+def test_plan_index_parses_unnormalized_plans(plan, expected):
+    """Test plan lines are read whole, whatever Markdown or day ranges older plans use."""
+    assert _plan_index(plan) == expected
+    assert _plan_index(_normalize_plan(plan)) == expected
+
+@pytest.mark.parametrize("plan, expected", [
+    ("Day 1-2: Gen 1-4\nDay 3-4: Gen 5", 4),
+    ("Day 1: Gen 1\nDay 2 - 1 Samuel 3", 2),
+    ("- **Day 6:** Gen 6 (Day 30 is a rest day)", 6),
+    ("Read slowly.", 0),
+], ids=["range", "dash_separator", "mention", "no_entries"])
+def test_last_planned_day(plan, expected):
+    """Test the plan's extent comes from its entries, so extensions and batches start on the right day."""
+    assert _last_planned_day(plan) == expected
+
+async def test_read_command_caches_reading_in_background(bot, drive, ai, update, context):
+    """Test /read answers without waiting for the reading's context cache, which later turns then use."""
+    context.user_data['drive_folder_id'] = "fid"
+    context.user_data['cache_name'] = "cachedContents/yesterday"
+    _serve_files(drive, {'profile.yaml': PROFILE_DAY1, 'reading_plan.yaml': PLAN_DAY1})
+    ai.aget_bible_text.return_value = "In the beginning..."
+    created = asyncio.Event()
+
+    async def create_cache(text, profile=None):
+        await created.wait()
+        return "cachedContents/today"
+    ai.acreate_reading_cache.side_effect = create_cache
+
+    assert await bot.read_command(update, context) == READING
+    assert 'cache_name' not in context.user_data
+
+    created.set()
+    await asyncio.wait(set(bot._background_tasks))
+    assert context.user_data['cache_name'] == "cachedContents/today"
+
+async def test_read_command_empty_plan_ends_conversation(bot, drive, ai, update, context):
+    """Test /read stops with an error when the reading plan file is empty."""
+    context.user_data['drive_folder_id'] = "fid"
+    _serve_files(drive, {'profile.yaml': PROFILE_DAY1, 'reading_plan.yaml': {}})
+
+    state = await bot.read_command(update, context)
+
+    assert state == ConversationHandler.END
+    assert "Reading plan is empty" in update.message.reply_text.call_args.args[0]
+    ai.aget_bible_text.assert_not_called()
+
+async def test_read_command_splits_long_passage(bot, drive, ai, update, context):
+    """Test passages over Telegram's message limit are sent in order, split at paragraph breaks."""
+    context.user_data['drive_folder_id'] = "fid"
+    _serve_files(drive, {
+        'profile.yaml': PROFILE_DAY1,
+        'reading_plan.yaml': {'plan': "Day 1: Psalm 119"},
+    })
+    ai.aget_bible_text.return_value = "\n\n".join(["Blessed are those... " * 20] * 15)
+
+    await bot.read_command(update, context)
+
+    parts = [c.args[0] for c in update.message.reply_text.call_args_list]
+    assert len(parts) == 2
+    assert parts[0].startswith("**Day 1: Psalm 119**")
+    assert parts[1].endswith("type /done.")
+    assert all(len(part) <= 4096 for part in parts)
+
+async def test_done_command(bot, drive, update, context):
+    """Test /done updates progress and transitions to DISCUSSION."""
+    context.user_data['drive_folder_id'] = "fid"
+    _serve_files(drive, {'profile.yaml': {'current_day': 1}})
+
+    state = await bot.done_command(update, context)
+
+    assert state == DISCUSSION
+    drive.write_yaml_file.assert_called()
+
+async def test_discussion_flow(bot, drive, ai, update, context):
+    """Test discussion handler uses AI and saves history."""
+    context.user_data['drive_folder_id'] = "fid"
+    context.user_data['profile'] = {'denomination': 'Baptist'}
+    context.user_data['chat_history'] = []
+
+    update.message.text = "What does this mean?"
+    ai.adiscuss_reading_stream.return_value = _astream("It ", "means...")
+
+    drive.get_file_id_by_name.return_value = None
+
+    state = await bot.discussion_handler(update, context)
+
+    assert state == DISCUSSION
+    # Placeholder is sent first, then edited with the streamed text
+    update.message.reply_text.assert_called_once_with("…")
+    assert context.bot.edit_message_text.call_args.kwargs['text'] == "It means..."
+    history = context.user_data['chat_history']
+    # Stored in the Gemini content format, one user/model pair per turn
+    assert [entry['role'] for entry in history[-2:]] == ['user', 'model']
+    assert history[-1] == {'role': 'model', 'parts': ["It means..."]}
+    # History is written behind: nothing hits Drive until the flush runs
+    drive.write_json_file.assert_not_called()
+    await bot._flush_folder("fid")
+    drive.write_json_file.assert_called_with(
+        "fid", 'chat_history.json', ANY, file_id=None
+    )
+
+async def test_discussion_survives_failed_reply_edits(bot, drive, ai, update, context, monkeypatch):
+    """Test failed intermediate edits of a streamed reply are skipped and the turn is still saved."""
+    monkeypatch.setattr('src.bot.STREAM_EDIT_INTERVAL', 0)
+    context.user_data['drive_folder_id'] = "fid"
+    context.user_data['chat_history'] = []
+    update.message.text = "What does this mean?"
+    ai.adiscuss_reading_stream.return_value = _astream("It ", "means...")
+    drive.get_file_id_by_name.return_value = None
+    context.bot.edit_message_text.side_effect = [RetryAfter(1), TimedOut(), None]
+
+    state = await bot.discussion_handler(update, context)
+
+    assert state == DISCUSSION
+    # Both intermediate edits failed, so the final text is edited in at the end
+    assert context.bot.edit_message_text.call_count == 3
+    assert context.bot.edit_message_text.call_args.kwargs['text'] == "It means..."
+    assert context.user_data['chat_history'][-1] == {'role': 'model', 'parts': ["It means..."]}
+
+def _telegram_update(update_id, user_id):
+    user = User(user_id, "Reader", False)
+    message = Message(update_id, datetime.now(timezone.utc), Chat(user_id, Chat.PRIVATE), from_user=user, text="Hi")
+    return Update(update_id, message=message)
+
+@pytest.mark.parametrize("user_ids, overlapped", [((1, 1), False), ((1, 2), True)],
+                         ids=["same_user", "different_users"])
+async def test_updates_run_in_order_per_user(user_ids, overlapped):
+    """Test a user's updates are handled one at a time (keeping their conversation state) while users overlap."""
+    processor = _PerUserUpdateProcessor(8)
+    running, overlaps = set(), []
+
+    async def handle(update_id):
+        overlaps.append(bool(running))
+        running.add(update_id)
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        running.discard(update_id)
+
+    await asyncio.gather(*(
+        processor.process_update(_telegram_update(update_id, user_id), handle(update_id))
+        for update_id, user_id in enumerate(user_ids)
+    ))
+
+    assert any(overlaps) == overlapped
+
+async def test_first_discussion_looks_history_up_once(bot, drive, ai, update, context):
+    """Test missing history files found by the batched lookup aren't looked up again one by one."""
+    context.user_data['drive_folder_id'] = "fid"
+    update.message.text = "Hi"
+    ai.adiscuss_reading_stream.return_value = _astream("Welcome")
+    drive.get_file_ids_by_name.return_value = {'chat_history.json': None, 'chat_history.yaml': None}
+
+    await bot.discussion_handler(update, context)
+
+    drive.get_file_ids_by_name.assert_called_once()
+    drive.get_file_id_by_name.assert_not_called()
+    assert context.user_data['chat_history'][-1] == {'role': 'model', 'parts': ["Welcome"]}
+
+async def test_discussion_survives_failed_extra_parts(bot, drive, ai, update, context, monkeypatch):
+    """Test a long reply whose extra parts can't be sent still saves the turn."""
+    monkeypatch.setattr('src.bot.MESSAGE_LIMIT', 10)
+    context.user_data['drive_folder_id'] = "fid"
+    context.user_data['chat_history'] = []
+    update.message.text = "Tell me everything"
+    ai.adiscuss_reading_stream.return_value = _astream("First part\n\nSecond one\n\nThird one")
+    drive.get_file_id_by_name.return_value = None
+    context.bot.send_message.side_effect = [RetryAfter(0), None, TimedOut()]
+
+    state = await bot.discussion_handler(update, context)
+
+    assert state == DISCUSSION
+    # The flood-limited part is retried once; the timed-out one is skipped
+    assert [c.kwargs['text'] for c in context.bot.send_message.call_args_list] == [
+        "Second one", "Second one", "Third one"
+    ]
+    assert context.user_data['chat_history'][-1]['parts'] == ["First part\n\nSecond one\n\nThird one"]
+
+async def test_discussion_uploads_history_every_few_turns(bot, drive, ai, update, context):
+    """Test chat history uploads are scheduled every CHAT_FLUSH_TURNS turns and on /done."""
+    context.user_data['drive_folder_id'] = "fid"
+    context.user_data['chat_history'] = []
+    drive.get_file_id_by_name.return_value = None
+
+    for turn in range(CHAT_FLUSH_TURNS):
+        assert "fid" not in bot._pending_flushes
+        update.message.text = f"Question {turn}"
+        ai.adiscuss_reading_stream.return_value = _astream("Answer")
+        await bot.discussion_handler(update, context)
+    assert "fid" in bot._pending_flushes
+
+    bot._pending_flushes.pop("fid").cancel()
+    ai.adiscuss_reading_stream.return_value = _astream("Answer")
+    await bot.discussion_handler(update, context)
+    assert "fid" not in bot._pending_flushes
+    drive.write_yaml_file.return_value = "p_id"
+    bot._store_cached("fid", 'profile.yaml', "p_id", {'current_day': 1})
+    await bot.done_command(update, context)
+    assert "fid" in bot._pending_flushes
+
+async def test_discussion_migrates_yaml_history(bot, drive, ai, update, context):
+    """Test a legacy chat_history.yaml is loaded and rewritten in place as JSON."""
+    context.user_data['drive_folder_id'] = "fid"
+    _serve_files(drive, {'chat_history.yaml': {'history': [{'role': 'user', 'parts': ["Hi"]}]}})
+    update.message.text = "Hello again"
+    ai.adiscuss_reading_stream.return_value = _astream("Welcome back")
+
+    await bot.discussion_handler(update, context)
+    await bot._flush_folder("fid")
+
+    assert context.user_data['chat_history'][0] == {'role': 'user', 'parts': ["Hi"]}
+    drive.write_json_file.assert_called_once_with("fid", 'chat_history.json', ANY, file_id="old_id")
+    drive.write_yaml_file.assert_not_called()
+
+async def test_discussion_history_trimmed_by_tokens(bot, drive, ai, update, context):
+    """Test an oversized old turn is dropped with its reply while the latest pair is kept."""
+    context.user_data['drive_folder_id'] = "fid"
+    context.user_data['chat_history'] = [
+        {'role': 'user', 'parts': ["x" * 8000]},
+        {'role': 'model', 'parts': ["Short reply"]},
+    ]
+    update.message.text = "And verse 2?"
+    ai.adiscuss_reading_stream.return_value = _astream("Verse 2 says...")
+    drive.get_file_id_by_name.return_value = None
+
+    await bot.discussion_handler(update, context)
+
+    assert context.user_data['chat_history'] == [
+        {'role': 'user', 'parts': ["And verse 2?"]},
+        {'role': 'model', 'parts': ["Verse 2 says..."]},
+    ]
+
+async def test_discussion_folds_old_turns_into_memory(bot, ai, update, context):
+    """Test long histories are summarized into the profile and cut to the latest turns."""
+    context.user_data['drive_folder_id'] = "fid"
+    context.user_data['cache_name'] = "cachedContents/reading"
+    context.user_data['chat_history'] = [
+        {'role': 'user' if i % 2 == 0 else 'model', 'parts': [f"turn {i}"]} for i in range(10)
+    ]
+    bot._store_cached("fid", 'profile.yaml', "p_id", {'current_day': 2})
+    update.message.text = "One more question"
+    ai.adiscuss_reading_stream.return_value = _astream("Answer")
+    ai.asummarize_history.return_value = "Likes Genesis."
+
+    await bot.discussion_handler(update, context)
+    await asyncio.sleep(0)
+
+    history = context.user_data['chat_history']
+    assert len(history) == 4
+    assert history[-1] == {'role': 'model', 'parts': ["Answer"]}
+    older = ai.asummarize_history.call_args.args[0]
+    assert [entry['parts'][0] for entry in older] == [f"turn {i}" for i in range(8)]
+    assert bot._drive_cache["fid"]['profile.yaml']['data']['rolling_memory'] == "Likes Genesis."
+    assert context.user_data['profile']['rolling_memory'] == "Likes Genesis."
+    # Built before the summary, the reading cache would hide the new memory
+    assert 'cache_name' not in context.user_data
+    assert bot._drive_cache["fid"]['profile.yaml']['dirty']
+
+async def test_drive_cache_reused_across_handlers(bot, drive, ai, update, context):
+    """Test /done reuses the profile cached by /read instead of re-reading Drive."""
+    context.user_data['drive_folder_id'] = "fid"
+    _serve_files(drive, {
+        'profile.yaml': PROFILE_DAY1,
+        'reading_plan.yaml': PLAN_DAY1,
+    })
+    drive.write_yaml_file.return_value = "p_id"
+    ai.aget_bible_text.return_value = "In the beginning..."
+
+    await bot.read_command(update, context)
+    await bot.done_command(update, context)
+
+    assert drive.read_yaml_file.call_count == 2
+    drive.write_yaml_file.assert_called_once_with(
+        "fid", 'profile.yaml', {'current_day': 2, 'translation': 'ESV'}, file_id="p_id"
+    )
+
+async def test_read_command_reloads_profile_edited_on_drive(bot, drive, ai, update, context):
+    """Test /read re-reads a stale cached profile only when its Drive version changed."""
+    context.user_data['drive_folder_id'] = "fid"
+    _serve_files(drive, {'profile.yaml': PROFILE_DAY1, 'reading_plan.yaml': PLAN_DAY2})
+    versions = {"p_id": "7", "plan_id": "3"}
+    drive.get_file_version.side_effect = versions.get
+    ai.aget_bible_text.return_value = "In the beginning..."
+    await bot.read_command(update, context)
+
+    # The user edits profile.yaml on Drive after it was cached
+    for entry in bot._drive_cache["fid"].values():
+        entry['checked_at'] -= 3600
+    versions["p_id"] = "8"
+    _serve_files(drive, {'profile.yaml': {'current_day': 2, 'translation': 'NIV'}, 'reading_plan.yaml': PLAN_DAY2})
+    drive.read_yaml_file.reset_mock()
+    ai.aget_bible_text.return_value = "Thus the heavens..."
+
+    await bot.read_command(update, context)
+
+    # Only the edited profile is downloaded again
+    drive.read_yaml_file.assert_called_once_with("p_id")
+    ai.aget_bible_text.assert_called_with("Gen 2", translation='NIV')
+
+async def test_own_write_is_not_mistaken_for_an_edit(bot, drive, ai, update, context):
+    """Test the version recorded after the bot's own upload keeps the cached profile valid."""
+    context.user_data['drive_folder_id'] = "fid"
+    _serve_files(drive, {'profile.yaml': PROFILE_DAY1, 'reading_plan.yaml': PLAN_DAY2})
+    versions = {"p_id": "7", "plan_id": "3"}
+    drive.get_file_version.side_effect = versions.get
+    drive.write_yaml_file.return_value = "p_id"
+    drive.written_version.side_effect = lambda file_id: versions.update(p_id="8") or "8"
+    ai.aget_bible_text.return_value = "In the beginning..."
+    await bot.read_command(update, context)
+    await bot.done_command(update, context)
+
+    for entry in bot._drive_cache["fid"].values():
+        entry['checked_at'] -= 3600
+    drive.read_yaml_file.reset_mock()
+    await bot.read_command(update, context)
+
+    drive.read_yaml_file.assert_not_called()
+
+async def test_done_keeps_progress_when_save_fails(bot, drive, ai, update, context):
+    """Test a failed profile upload leaves the cached and in-memory day as Drive has it."""
+    context.user_data['drive_folder_id'] = "fid"
+    bot._store_cached("fid", 'profile.yaml', "p_id", dict(PROFILE_DAY1))
+    context.user_data['profile'] = bot._drive_cache["fid"]['profile.yaml']['data']
+    drive.write_yaml_file.side_effect = Exception("Rate limit exceeded")
+
+    state = await bot.done_command(update, context)
+
+    assert state == READING
+    assert bot._drive_cache["fid"]['profile.yaml']['data']['current_day'] == 1
+    assert context.user_data['profile']['current_day'] == 1
+    assert "send /done again" in update.message.reply_text.call_args.args[0]
+
+    # Retrying advances by exactly one day
+    drive.write_yaml_file.side_effect = None
+    drive.write_yaml_file.return_value = "p_id"
+    await bot.done_command(update, context)
+    assert context.user_data['profile']['current_day'] == 2
+
+async def test_done_prefetches_next_reading(bot, drive, ai, update, context):
+    """Test /done fetches tomorrow's text so the next /read doesn't wait for it."""
+    context.user_data['drive_folder_id'] = "fid"
+    bot._store_cached("fid", 'profile.yaml', "p_id", dict(PROFILE_DAY1))
+    bot._store_cached("fid", 'reading_plan.yaml', "plan_id", dict(PLAN_DAY2))
+    drive.write_yaml_file.return_value = "p_id"
+    ai.aget_bible_text.return_value = "Thus the heavens..."
+
+    await bot.done_command(update, context)
+    # Held by the bot until it finishes, so it can't be collected mid-flight
+    assert len(bot._background_tasks) == 1
+    await asyncio.wait(set(bot._background_tasks))
+    assert context.user_data['prefetched_scripture'] == {2: ("Gen 2", "Thus the heavens...")}
+    assert not bot._background_tasks
+
+    state = await bot.read_command(update, context)
+
+    assert state == READING
+    ai.aget_bible_text.assert_called_once_with("Gen 2", translation='ESV')
+    assert context.user_data['current_scripture'] == "Thus the heavens..."
 
-        self.mock_update.message.reply_text.assert_called_once()
-        args = self.mock_update.message.reply_text.call_args[0][0]
+async def test_help_command(bot, update, context):
+    """Test /help command sends the help message."""
+    await bot.help_command(update, context)
 
-        # Verify it contains all commands
-        self.assertIn("/start", args)
-        self.assertIn("/read", args)
-        self.assertIn("/done", args)
-        self.assertIn("/cancel", args)
-        self.assertIn("/help", args)
-        self.assertIn("**Bible Companion Commands**", args)
+    update.message.reply_text.assert_called_once()
+    args = update.message.reply_text.call_args[0][0]
 
-if __name__ == '__main__':
-    unittest.main()
+    # Verify it contains all commands
+    assert "/start" in args
+    assert "/read" in args
+    assert "/done" in args
+    assert "/cancel" in args
+    assert "/help" in args
+    assert "**Bible Companion Commands**" in args
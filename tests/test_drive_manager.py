@@ -0,0 +1,129 @@
+import re
+from urllib.parse import parse_qs, urlparse
+
+import httpx
+from googleapiclient.discovery import build
+
+from src.drive_manager import GoogleDriveManager, _Http2Transport
+
+_BATCH_BOUNDARY = "batch_boundary"
+
+
+def _manager(handler):
+    """A Drive manager whose service talks to `handler` through the HTTP/2 transport."""
+    manager = GoogleDriveManager(credentials_path=None)
+    manager._creds = object()
+    http = _Http2Transport(httpx.Client(transport=httpx.MockTransport(handler)))
+    manager._local.service = build('drive', 'v3', http=http)
+    return manager
+
+def _list_response(query, files):
+    """Answers a files.list query with the ID of the file it names, if any."""
+    name = re.match(r"name = '((?:[^'\\]|\\.)*)'", query).group(1)
+    name = name.replace("\\'", "'").replace('\\\\', '\\')
+    return {'files': [{'id': files[name]}] if name in files else []}
+
+def test_transport_maps_responses():
+    """Test the transport returns httplib2-style status and lowercase headers, following redirects."""
+    def handler(request):
+        if request.url.path == "/old":
+            return httpx.Response(302, headers={'Location': "https://example.com/new"})
+        return httpx.Response(200, headers={'X-Goog-Trace': "abc"}, content=b"done")
+
+    transport = _Http2Transport(httpx.Client(transport=httpx.MockTransport(handler)))
+    response, content = transport.request("https://example.com/old")
+
+    assert response.status == 200
+    assert response['x-goog-trace'] == "abc"
+    assert content == b"done"
+
+def test_lookup_escapes_quotes_in_names():
+    """Test a filename with a quote is sent as an escaped Drive query string."""
+    queries = []
+
+    def handler(request):
+        queries.append(parse_qs(urlparse(str(request.url)).query)['q'][0])
+        return httpx.Response(200, json=_list_response(queries[-1], {"it's.yaml": "quoted_id"}))
+
+    manager = _manager(handler)
+
+    assert manager.get_file_id_by_name("fid", "it's.yaml") == "quoted_id"
+    assert queries == ["name = 'it\\'s.yaml' and 'fid' in parents and trashed = false"]
+
+def test_lookups_share_one_batch_request():
+    """Test several filenames are resolved with a single batched Drive request."""
+    files = {'profile.yaml': "p_id", 'reading_plan.yaml': "plan_id"}
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        body = request.content.decode()
+        parts = []
+        for content_id, path in re.findall(r"Content-ID: <(.+?)>.*?GET (\S+)", body, re.DOTALL):
+            query = parse_qs(urlparse(path).query)['q'][0]
+            parts.append(
+                f"--{_BATCH_BOUNDARY}\r\nContent-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n"
+                f"{httpx.Response(200, json=_list_response(query, files)).text}\r\n"
+            )
+        return httpx.Response(
+            200, headers={'Content-Type': f"multipart/mixed; boundary={_BATCH_BOUNDARY}"},
+            content="".join(parts) + f"--{_BATCH_BOUNDARY}--"
+        )
+
+    manager = _manager(handler)
+    found = manager.get_file_ids_by_name("fid", ['profile.yaml', 'reading_plan.yaml', 'chat_history.json'])
+
+    assert found == {'profile.yaml': "p_id", 'reading_plan.yaml': "plan_id", 'chat_history.json': None}
+    assert len(requests) == 1
+    assert requests[0].url.path.endswith("/batch/drive/v3")
+    # Found IDs are remembered, so the next lookup doesn't call Drive
+    assert manager.get_file_id_by_name("fid", 'profile.yaml') == "p_id"
+    assert len(requests) == 1
+
+def test_failed_batch_lookups_are_left_out():
+    """Test names the batch couldn't look up are omitted rather than reported missing."""
+    manager = _manager(lambda request: httpx.Response(500, content=b"backend error"))
+
+    assert manager.get_file_ids_by_name("fid", ['profile.yaml', 'reading_plan.yaml']) == {}
+
+def test_files_download_as_media():
+    """Test file contents are fetched with a single alt=media request and parsed."""
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, content=b"current_day: 3\n")
+
+    manager = _manager(handler)
+
+    assert manager.read_yaml_file("p_id") == {'current_day': 3}
+    assert len(requests) == 1
+    assert requests[0].url.path == "/drive/v3/files/p_id"
+    assert parse_qs(requests[0].url.query.decode())['alt'] == ["media"]
+
+def test_uploads_record_the_new_version():
+    """Test updating and creating files sends a multipart upload and remembers the version Drive returns."""
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        file_id = "p_id" if request.method == "PATCH" else "new_id"
+        return httpx.Response(200, json={'id': file_id, 'version': "7"})
+
+    manager = _manager(handler)
+
+    assert manager.write_yaml_file("fid", 'profile.yaml', {'current_day': 4}, file_id="p_id") == "p_id"
+    assert manager.write_json_file("fid", 'chat_history.json', {'turns': []}, file_id=None) == "new_id"
+
+    update, lookup, create = requests
+    assert (update.method, update.url.path) == ("PATCH", "/upload/drive/v3/files/p_id")
+    assert lookup.url.path == "/drive/v3/files"
+    assert (create.method, create.url.path) == ("POST", "/upload/drive/v3/files")
+    for upload in (update, create):
+        query = parse_qs(upload.url.query.decode())
+        assert query['uploadType'] == ["multipart"]
+        assert query['fields'] == ["id,version"]
+    assert b"current_day: 4" in update.content
+    assert manager.written_version("p_id") == manager.written_version("new_id") == "7"
@@ -0,0 +1,41 @@
+import pytest
+
+from src.response_cache import ScriptureCache, SemanticCache
+
+
+@pytest.fixture
+def scripture_cache(tmp_path):
+    cache = ScriptureCache(path=str(tmp_path / 'cache.sqlite3'))
+    yield cache
+    cache._conn.close()
+
+def test_scripture_hit_ignores_case_and_spacing(scripture_cache):
+    """Test a stored passage is found again for an equivalent reference."""
+    scripture_cache.set("Genesis 1", "esv", "In the beginning...")
+    assert scripture_cache.get("genesis  1", "ESV") == "In the beginning..."
+    assert scripture_cache.get("Genesis 1", "NIV") is None
+
+def test_expired_scripture_entry_is_a_miss(scripture_cache):
+    """Test entries older than the TTL are not served."""
+    scripture_cache.ttl_seconds = -1
+    scripture_cache.set("John 3:16", "ESV", "For God so loved...")
+    assert scripture_cache.get("John 3:16", "ESV") is None
+
+def test_semantic_lookup_requires_similarity_and_same_reading():
+    """Test answers are served only for near-duplicate questions about the same reading."""
+    cache = SemanticCache(min_similarity=0.92)
+    cache.store(1, "gen-1", [1.0, 0.0], "It means...")
+
+    assert cache.lookup(1, "gen-1", [0.99, 0.05]) == "It means..."
+    assert cache.lookup(1, "gen-1", [0.5, 0.5]) is None
+    assert cache.lookup(1, "gen-2", [1.0, 0.0]) is None
+    assert cache.lookup(2, "gen-1", [1.0, 0.0]) is None
+
+def test_semantic_lookup_requires_same_context():
+    """Test a follow-up only matches an answer given after the same previous reply."""
+    cache = SemanticCache(min_similarity=0.92)
+    cache.store(1, "gen-1", [1.0, 0.0], "Because of the flood.", context_key="reply-a")
+
+    assert cache.lookup(1, "gen-1", [1.0, 0.0], context_key="reply-a") == "Because of the flood."
+    assert cache.lookup(1, "gen-1", [1.0, 0.0], context_key="reply-b") is None
+    assert cache.lookup(1, "gen-1", [1.0, 0.0]) is None